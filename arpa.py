@@ -0,0 +1,308 @@
+# ARPA Language Model Files (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                        ARPA LANGUAGE MODELS                                    #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+Reading and writing n-gram language models in the ARPA format used by SRILM, KenLM, IRSTLM, etc.
+An ARPA file lists, after a header giving the number of n-grams of each order, one section per
+order with a line for every n-gram:
+
+    log10 probability <tab> w1 ... wk [<tab> log10 backoff weight]
+
+Models are read into a BackoffLM (whose log probabilities are natural logs), and any model with
+NumNGrams / NGrams (a BackoffLM or a FrozenBigramLM) can be written out.
+
+"""
+
+import sys
+from array import array
+from math import log
+from backoff import BackoffLM, WORD_BITS, WORD_MASK
+from bigram import FrozenBigramLM
+
+LOG_10 = log(10)
+
+# the log10 probability given to unknown words when a file has no "<unk>" entry
+UNKNOWN_LOG10_PROB = -100.0
+
+# the log10 probability written for "<s>", which only ever starts a context
+START_LOG10_PROB = -99.0
+
+# read_arpa
+#
+# args:     file_name       an ARPA file
+#           [vocab]         (OPTIONAL) the Vocabulary to intern words in, e.g. to share ids with
+#                           a translation table; a new one is created by default
+#
+# returns:  the BackoffLM stored in the file
+#
+# notes:    the file is read line by line, and each order is kept only as parallel arrays of
+#           packed n-grams and scores until it is sorted into the trie, so no dict is ever
+#           built over the n-grams
+
+def read_arpa(file_name, vocab=None):
+
+    model   = None
+    counts  = {}
+    parents = None
+
+    # the section being read: its order, packed n-grams, log probabilities and backoff weights
+    k = 0
+    (ngrams, log_probs, backoffs) = ([], array('f'), array('f'))
+
+    with open(file_name, 'r') as f:
+        for line in f:
+
+            line = line.strip()
+
+            if not line or line == "\\data\\":
+                continue
+
+            if line.startswith("ngram "):
+                (order, count) = line[len("ngram "):].split("=")
+                counts[int(order)] = int(count)
+                continue
+
+            if line.startswith("\\") and line.endswith("-grams:") or line == "\\end\\":
+
+                if model is None:
+                    model = BackoffLM(max(counts), vocab)
+
+                if k:
+                    parents = add_level(model, k, parents, ngrams, log_probs, backoffs)
+
+                if line == "\\end\\":
+                    break
+
+                k = int(line[1:line.index("-")])
+                (ngrams, log_probs, backoffs) = ([], array('f'), array('f'))
+                continue
+
+            if not k:
+                continue
+
+            fields = line.split()
+
+            ngram = 0
+            for word in fields[1:k + 1]:
+                ngram = (ngram << WORD_BITS) | model.vocab.add(word)
+
+            ngrams.append(ngram)
+            log_probs.append(float(fields[0]) * LOG_10)
+            backoffs.append(float(fields[k + 1]) * LOG_10 if len(fields) > k + 1 else 0.0)
+
+    if model is None:
+        raise ValueError("%s is not an ARPA file." % file_name)
+
+    if len(model.vocab) > WORD_MASK:
+        raise ValueError("The vocabulary is too large to pack into n-grams.")
+
+    return model
+
+# add_level
+#
+# args:     model           the BackoffLM being read
+#           k               the order of the section that was read
+#           parents         the sorted, packed (k - 1)-grams stored in the model (None for k = 1)
+#           ngrams          the packed k-grams of the section, in file order
+#           log_probs       the natural log probabilities of ngrams
+#           backoffs        the natural log backoff weights of ngrams
+#
+# returns:  the sorted, packed k-grams that were stored (the parents of the next order); k-grams
+#           whose context is not in the model are dropped, as the trie cannot reach them
+
+def add_level(model, k, parents, ngrams, log_probs, backoffs):
+
+    if k == 1:
+
+        # the unigram level is indexed by word id: it covers every word of the vocabulary,
+        # giving words that are not in the file the probability of "<unk>"
+        V = len(model.vocab)
+        unknown = model.vocab.get("<unk>")
+
+        model.num_words = V
+        model.unknown_log_prob = UNKNOWN_LOG10_PROB * LOG_10
+
+        for (i, word) in enumerate(ngrams):
+            if word == unknown:
+                model.unknown_log_prob = log_probs[i]
+
+        model.log_probs[1] = array('f', [model.unknown_log_prob]) * V
+        model.backoffs[1]  = array('f', [0.0]) * V
+
+        for (i, word) in enumerate(ngrams):
+            model.log_probs[1][word] = log_probs[i]
+            model.backoffs[1][word]  = backoffs[i]
+
+        return range(V)
+
+    # sort the section, keeping only the k-grams that extend a stored (k - 1)-gram
+    kept = []
+    p = 0
+    for i in sorted(range(len(ngrams)), key=ngrams.__getitem__):
+
+        context = ngrams[i] >> WORD_BITS
+        while p < len(parents) and parents[p] < context:
+            p = p + 1
+
+        if p < len(parents) and parents[p] == context:
+            kept.append(i)
+
+    stored = [ngrams[i] for i in kept]
+
+    model.Link(k, parents, stored)
+    model.log_probs[k] = array('f', (log_probs[i] for i in kept))
+
+    if k < model.order:
+        model.backoffs[k] = array('f', (backoffs[i] for i in kept))
+
+    return stored
+
+# write_arpa
+#
+# args:     model           a language model with NumNGrams / NGrams (a BackoffLM or a
+#                           FrozenBigramLM)
+#           file_name       the file to write the model to
+#
+# returns:  none; writes the model in ARPA format, adding the unigrams the format expects if the
+#           model has none for them (see marker_unigrams)
+
+def write_arpa(model, file_name):
+
+    order = model.order
+    markers = marker_unigrams(model)
+
+    with open(file_name, 'w') as f:
+
+        f.write("\\data\\\n")
+        for k in range(1, order + 1):
+            count = model.NumNGrams(k) + (len(markers) if k == 1 else 0)
+            f.write("ngram %d=%d\n" % (k, count))
+
+        for k in range(1, order + 1):
+
+            f.write("\n\\%d-grams:\n" % k)
+
+            if k == 1:
+                for (word, log_prob) in markers:
+                    write_ngram(f, log_prob, word, 0.0 if order > 1 else None)
+
+            for (ngram, log_prob, backoff) in model.NGrams(k):
+                write_ngram(f, log_prob, " ".join(model.vocab.decode(ngram)),
+                            backoff if k < order else None)
+
+        f.write("\n\\end\\\n")
+
+# marker_unigrams
+#
+# args:     model           a language model with NumNGrams / NGrams
+#
+# returns:  the (word, natural log probability) of every special unigram the model has no entry
+#           for: "<unk>" (with the model's probability for unknown words), "<s>" (which is never
+#           predicted, so it gets the conventional log10 probability of -99) and "</s>" (a
+#           model trained without sentence boundaries, such as a FrozenBigramLM, scores it as
+#           an unknown word); KenLM, for one, refuses a file without "<s>" and "</s>"
+#
+# notes:    the added unigrams have a backoff weight of 0, so a context made of one of them
+#           backs off to the unigram distribution unchanged
+
+def marker_unigrams(model):
+
+    V = model.NumNGrams(1)
+
+    def missing(word):
+        word_id = model.vocab.get(word)
+        return word_id is None or not 0 <= word_id < V
+
+    markers = [("<unk>", model.unknown_log_prob), ("<s>", START_LOG10_PROB * LOG_10),
+               ("</s>", model.unknown_log_prob)]
+
+    return [(word, log_prob) for (word, log_prob) in markers if missing(word)]
+
+# write_ngram
+#
+# args:     f               the open ARPA file
+#           log_prob        the natural log probability of the n-gram
+#           words           the words of the n-gram, space-separated
+#           backoff         the natural log backoff weight of the n-gram, or None for n-grams of
+#                           the highest order (which have none)
+#
+# returns:  none; writes the ARPA line for the n-gram
+
+def write_ngram(f, log_prob, words, backoff):
+
+    if backoff is None:
+        f.write("%.7g\t%s\n" % (log_prob / LOG_10, words))
+    else:
+        f.write("%.7g\t%s\t%.7g\n" % (log_prob / LOG_10, words, backoff / LOG_10))
+
+# check_arpa
+#
+# args:     model           a language model with NumNGrams / NGrams
+#           file_name       the file to export the model to
+#
+# returns:  the number of entries that do not read back as written: writes the model with
+#           write_arpa, reads the file back with read_arpa, and compares the log probability
+#           and backoff weight of every n-gram of the model, counting a missing "<s>" or "</s>"
+#           unigram as a difference too
+#
+# notes:    scores are compared to the precision they are written with (7 significant digits)
+
+def check_arpa(model, file_name):
+
+    write_arpa(model, file_name)
+    read = read_arpa(file_name)
+
+    def same(x, y):
+        return abs(x - y) <= 1e-5 * max(1.0, abs(x))
+
+    # the unigrams in the file itself (a BackoffLM always interns "<s>" and "</s>", so the
+    # model read back has them either way)
+    unigrams = set()
+    with open(file_name, 'r') as f:
+
+        section = None
+        for line in f:
+
+            line = line.strip()
+
+            if line.startswith("\\"):
+                section = line
+            elif section == "\\1-grams:" and line:
+                unigrams.add(line.split()[1])
+
+    differ = len(set(["<s>", "</s>"]) - unigrams)
+
+    for k in range(1, model.order + 1):
+        for (ngram, log_prob, backoff) in model.NGrams(k):
+
+            i = read.Find(read.vocab.encode(model.vocab.decode(ngram)))
+
+            if i < 0 or not same(log_prob, read.log_probs[k][i]):
+                differ = differ + 1
+            elif k < model.order and not same(backoff, read.backoffs[k][i]):
+                differ = differ + 1
+
+    return differ
+
+def main():
+
+    if len(sys.argv) < 3:
+        print "usage: python arpa.py <bigram model file> <ARPA output file>"
+        sys.exit(1)
+
+    model = FrozenBigramLM()
+    model.Load(sys.argv[1])
+
+    print "entries that do not read back:", check_arpa(model, sys.argv[2])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# Backoff Language Model (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                    BACKOFF LANGUAGE MODEL                                      #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+An n-gram language model in backoff form: the log probability of a word after a context is that
+of the longest n-gram (context suffix + word) the model holds, plus the backoff weights of every
+longer suffix of the context that the model holds but does not extend with the word.
+
+The model is stored as a trie of sorted arrays: level k holds every k-gram, grouped by context
+(its first k - 1 words) and sorted by last word, and each entry of level k points at the range
+of its extensions in level k + 1. Per n-gram, this costs a word id and a float (plus a backoff
+weight and a child offset below the highest order).
+
+The trie is filled by the models that estimate it (see KneserNeyLM) or read from a file (see
+read_arpa).
+
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+from vocab import Vocabulary
+from quantize import quantize, QuantizedArray
+
+# n-grams are packed into single integers, WORD_BITS bits per word id (first word in the highest
+# bits), while a trie is being built; sorting the packed n-grams sorts them by context, then by
+# last word
+WORD_BITS = 21
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# BackoffLM
+#
+# "<s>" and "</s>" (which mark the start and end of each sentence) are always in the model's
+# vocabulary. The model is queried through LM states: a state is the tuple of (up to order - 1)
+# word ids that the next word is conditioned on, and is kept as short as possible, so that
+# hypotheses whose histories only differ in words the model cannot see share a state
+
+class BackoffLM:
+
+    # init
+    #
+    # args:     order       the order of the model (3 for a trigram model)
+    #           [vocab]     (OPTIONAL) the Vocabulary to intern words in, e.g. to share ids with
+    #                       a translation table; a new one is created by default
+
+    def __init__(self, order, vocab=None):
+
+        if order < 1:
+            raise ValueError("The order of the model must be at least 1.")
+
+        self.order = order
+        self.vocab = vocab if vocab is not None else Vocabulary()
+
+        self.start_token = self.vocab.add("<s>")
+        self.end_token   = self.vocab.add("</s>")
+
+        # the trie, indexed by order (index 0 is unused):
+        # - words[k][i]: the last word (id) of the i-th k-gram (level 1 is indexed by word id)
+        # - log_probs[k][i]: the log probability of the i-th k-gram
+        # - backoffs[k][i]: the log backoff weight of the i-th k-gram, as a context
+        # - children[k][i] .. children[k][i + 1]: the range of the i-th k-gram's extensions in
+        #   level k + 1
+        self.words     = [None] * (order + 1)
+        self.log_probs = [None] * (order + 1)
+        self.backoffs  = [None] * (order + 1)
+        self.children  = [None] * (order + 1)
+
+        # number of words in the unigram level, and the log probability of any word outside it
+        self.num_words = 0
+        self.unknown_log_prob = 0.0
+
+    # Link
+    #
+    # args:     k           the order of the level to add (at least 2)
+    #           parents     the packed (k - 1)-grams of level k - 1, sorted (for level 1, the
+    #                       word ids 0 .. num_words - 1)
+    #           ngrams      the packed k-grams of the new level, sorted; the context of each
+    #                       must be one of parents
+    #
+    # returns:  none; stores the last words of ngrams as level k of the trie, and points every
+    #           entry of level k - 1 at its extensions
+
+    def Link(self, k, parents, ngrams):
+
+        self.words[k] = array('i', (ngram & WORD_MASK for ngram in ngrams))
+
+        children = self.children[k - 1] = array('i', [0]) * (len(parents) + 1)
+
+        # both levels are sorted, so the extensions of each parent are the next run of ngrams
+        j = 0
+        for (p, parent) in enumerate(parents):
+
+            children[p] = j
+            while j < len(ngrams) and ngrams[j] >> WORD_BITS == parent:
+                j = j + 1
+
+        children[len(parents)] = j
+
+    # Quantize
+    #
+    # args:     [bits]      (OPTIONAL) the number of bits per score (1 to 16)
+    #
+    # returns:  the largest absolute error the quantization introduced into a score; replaces
+    #           the log probabilities and backoff weights of every level above the unigrams with
+    #           QuantizedArrays, one codebook per level and kind of score
+    #
+    # notes:    the unigram level is indexed by word id and is kept exact, as in KenLM. The
+    #           lists of levels are replaced (never modified), so quantizing a copy.copy of a
+    #           model leaves the model itself untouched; a model can only be quantized once
+
+    def Quantize(self, bits=8):
+
+        if any(isinstance(level, QuantizedArray) for level in self.log_probs):
+            raise ValueError("The model is already quantized.")
+
+        self.log_probs = list(self.log_probs)
+        self.backoffs  = list(self.backoffs)
+
+        error = 0.0
+
+        for levels in (self.log_probs, self.backoffs):
+            for k in range(2, self.order + 1):
+
+                if levels[k] is None:
+                    continue
+
+                quantized = quantize(levels[k], bits)
+                error = max(error, quantized.codebook.max_error(levels[k]))
+                levels[k] = quantized
+
+        return error
+
+    # NumNGrams
+    #
+    # args:     k           an order of the model
+    #
+    # returns:  the number of k-grams in the model
+
+    def NumNGrams(self, k):
+
+        return self.num_words if k == 1 else len(self.words[k])
+
+    # NGrams
+    #
+    # args:     k           an order of the model
+    #
+    # returns:  a generator over the (k-gram, log probability, log backoff weight) of every 
+    #           k-gram in the model, in trie order, where each k-gram is a tuple of word ids
+
+    def NGrams(self, k):
+
+        log_probs = self.log_probs[k]
+        backoffs  = self.backoffs[k]
+
+        for (ngram, i) in self.Entries(k):
+            yield (ngram, log_probs[i], backoffs[i] if backoffs is not None else 0.0)
+
+    # Entries
+    #
+    # args:     k           an order of the model
+    #
+    # returns:  a generator over the (k-gram, position in level k) of every k-gram in the model
+
+    def Entries(self, k):
+
+        if k == 1:
+            for word in range(self.num_words):
+                yield ((word,), word)
+            return
+
+        children = self.children[k - 1]
+        words    = self.words[k]
+
+        for (context, p) in self.Entries(k - 1):
+            for i in range(children[p], children[p + 1]):
+                yield (context + (words[i],), i)
+
+    # Unpack
+    #
+    # args:     ngram       a packed n-gram
+    #           k           the number of words in the n-gram
+    #
+    # returns:  the tuple of word ids in the n-gram
+
+    def Unpack(self, ngram, k):
+
+        return tuple((ngram >> (WORD_BITS * (k - 1 - i))) & WORD_MASK for i in range(k))
+
+    # Find
+    #
+    # args:     ngram       a tuple of word ids (at most order words long)
+    #
+    # returns:  the position of the n-gram in level len(ngram) of the trie, or -1 if the model
+    #           has not seen it
+
+    def Find(self, ngram):
+
+        word = ngram[0]
+        if word is None or not 0 <= word < self.num_words:
+            return -1
+
+        i = word
+        for k in range(2, len(ngram) + 1):
+
+            word = ngram[k - 1]
+            if word is None:
+                return -1
+
+            lo = self.children[k - 1][i]
+            hi = self.children[k - 1][i + 1]
+            i  = bisect_left(self.words[k], word, lo, hi)
+
+            if i >= hi or self.words[k][i] != word:
+                return -1
+
+        return i
+
+    # LogProb
+    #
+    # args:     context     a tuple of (up to order - 1) word ids
+    #           word        the word (id) to score
+    #
+    # returns:  the log probability of word given context, backing off to shorter contexts (and
+    #           collecting their backoff weights) until the n-gram is found
+
+    def LogProb(self, context, word):
+
+        log_prob = 0.0
+
+        for m in range(min(len(context), self.order - 1), 0, -1):
+
+            parent = self.Find(context[-m:])
+            if parent < 0:
+                continue
+
+            lo = self.children[m][parent]
+            hi = self.children[m][parent + 1]
+            i  = bisect_left(self.words[m + 1], word, lo, hi)
+
+            if i < hi and self.words[m + 1][i] == word:
+                return log_prob + self.log_probs[m + 1][i]
+
+            log_prob = log_prob + self.backoffs[m][parent]
+
+        if word is not None and 0 <= word < self.num_words:
+            return log_prob + self.log_probs[1][word]
+        else:
+            return log_prob + self.unknown_log_prob
+
+    # State
+    #
+    # args:     history     a tuple of word ids, most recent last
+    #
+    # returns:  the LM state for the history: its last order - 1 words, less any leading words
+    #           that no n-gram of the model extends (they cannot change a later score)
+
+    def State(self, history):
+
+        state = history[len(history) - (self.order - 1):]
+
+        while state:
+
+            k = len(state)
+            i = self.Find(state)
+
+            if i >= 0 and self.children[k][i] < self.children[k][i + 1]:
+                break
+
+            state = state[1:]
+
+        return state
+
+    # BeginState
+    #
+    # args:     none
+    #
+    # returns:  the LM state at the start of a sentence
+
+    def BeginState(self):
+
+        return self.State((self.start_token,))
+
+    # Score
+    #
+    # args:     state       an LM state (None for no context)
+    #           word        the next word (id)
+    #
+    # returns:  (log probability of word in state, the LM state after word)
+
+    def Score(self, state, word):
+
+        if state is None:
+            state = ()
+
+        return (self.LogProb(state, word), self.State(state + (word,)))
+
+    # ScorePhrase
+    #
+    # args:     words       a sequence of word ids
+    #           [state]     (OPTIONAL) the LM state before the phrase; by default the phrase is
+    #                       scored with no context
+    #
+    # returns:  (total log probability of the words, the LM state after them)
+
+    def ScorePhrase(self, words, state=None):
+
+        total = 0.0
+        for word in words:
+            (log_prob, state) = self.Score(state, word)
+            total = total + log_prob
+
+        return (total, state)
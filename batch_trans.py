@@ -0,0 +1,133 @@
+# Batch Translation (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                        BATCH TRANSLATION                                       #
+#                                                                                                #
+##################################################################################################
+
+import os
+import sys
+from multiprocessing import Pool
+from beam_search import BeamSearch
+from phrase_table import convert_translations, load_phrase_table
+from utilities import tokenize, get_datasets, write_nbest
+
+# the decoder used by the worker processes; it is set before the pool is created, so every
+# (forked) worker inherits the trained language model and translation table copy-on-write
+# instead of re-training its own
+search = None
+
+# the size of the n-best lists the workers return (see translate_sentence_nbest)
+nbest_size = None
+
+# translate_sentence
+#
+# args:     source_sent     the source (foreign) sentence
+#
+# returns:  the beam search translation of the sentence, as a single line of text
+
+def translate_sentence(source_sent):
+
+    return ' '.join(search.translate(source_sent))
+
+# translate_sentence_nbest
+#
+# args:     source_sent     the source (foreign) sentence
+#
+# returns:  (the best translation of the sentence as a single line of text, its n-best list of
+#           nbest_size entries as returned by BeamSearch.translate_nbest), from a single decode
+
+def translate_sentence_nbest(source_sent):
+
+    nbest = search.translate_nbest(source_sent, nbest_size)
+
+    if not nbest:
+        return ("No translation found.", nbest)
+
+    return (' '.join(nbest[0][0]), nbest)
+
+# translate_all
+#
+# args:     decoder         a BeamSearch instance (with its language model already trained)
+#           sentences       the source (foreign) sentences to translate
+#           processes       the number of worker processes (defaults to the number of CPUs)
+#           chunksize       the number of sentences handed to a worker at a time
+#           [nbest]         (OPTIONAL) if given, the number of translations to return per
+#                           sentence
+#
+# returns:  a generator over the translations of the sentences, in input order; with nbest,
+#           over (translation, n-best list) pairs (see translate_sentence_nbest)
+#
+# notes:    relies on fork-based process start (the default on Linux / OS X) to share decoder
+#           with the workers
+
+def translate_all(decoder, sentences, processes=None, chunksize=8, nbest=None):
+
+    global search, nbest_size
+    search = decoder
+    nbest_size = nbest
+
+    worker = translate_sentence_nbest if nbest else translate_sentence
+
+    pool = Pool(processes)
+
+    try:
+        for translation in pool.imap(worker, sentences, chunksize):
+            yield translation
+    finally:
+        pool.terminate()
+        pool.join()
+
+def main():
+
+    args = sys.argv[1:]
+
+    # --nbest k also writes the k best translations of every sentence to trans_nbest.txt
+    nbest = None
+    if "--nbest" in args:
+        i = args.index("--nbest")
+        nbest = int(args[i + 1])
+        del args[i:i + 2]
+
+    processes = int(args[0]) if args else None
+
+    english = tokenize("data/100ktok.low.en")
+    spanish = tokenize("data/100ktok.low.es")
+
+    training_set, test_set, translated_set = get_datasets(english, spanish)
+    # the text table is converted to a binary table once; later runs memory-map it
+    if not os.path.exists("3000_trans.table"):
+        convert_translations("3000_trans.txt", "3000_trans.table")
+
+    translations = load_phrase_table("3000_trans.table")
+    # the language model is trained once and saved to lm_cache; later runs memory-map it
+    decoder = BeamSearch(training_set, translations, lm_cache="lm_cache")
+
+    test_output = open('trans_beam.txt','w')
+    true_output = open('trans_true.txt','w')
+    nbest_output = open('trans_nbest.txt','w') if nbest else None
+
+    for (i, translation) in enumerate(translate_all(decoder, test_set, processes, nbest=nbest)):
+
+        if i % 100 == 0:
+            print "Translating sentence", i, "of", len(test_set), "..."
+
+        if nbest:
+            (translation, nbest_list) = translation
+            write_nbest(nbest_output, i, nbest_list)
+
+        test_output.write(translation + "\n")
+        true_output.write(' '.join(translated_set[i]) + "\n")
+
+    test_output.close()
+    true_output.close()
+
+    if nbest_output is not None:
+        nbest_output.close()
+
+if __name__ == "__main__":
+    main()
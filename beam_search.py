@@ -44,100 +44,833 @@ Other helpful information on the algorithm behind beam search is available in:
 #                                                                                                #
 ##################################################################################################
 
+import os
 import sys
-import collections
 import copy
+import heapq
+import itertools
+import collections
 from math import log, pow
-from bigram import BigramLM
+from bigram import BigramLM, FrozenBigramLM
+from kneser_ney import KneserNeyLM
+from vocab import Vocabulary
+from utilities import intern_translations, english_words, corpus_fingerprint, decoder_input
+from phrase_table import PhraseTable, PhraseTrie
 
 # enums for pruning methods
 class Prune(object):
     THRESHOLD = 1
     HISTOGRAM = 2
 
-# custom exception if there are no available transitions between two tokens
-# (used when we are employing Viterbi)
-class UnknownTransitionError(ValueError): pass
+# enums for decoding methods
+#
+#   STACK           every hypothesis is expanded with every applicable translation option
+#   CUBE_PRUNING    each stack is filled best-first from sorted hypotheses x sorted options,
+#                   only scoring candidates until the stack stops admitting them
+class Decode(object):
+    STACK        = 1
+    CUBE_PRUNING = 2
+
+# enums for language model smoothing
+#
+#   LAPLACE         a bigram model with Laplace (add-one) smoothing (see BigramLM)
+#   KNESER_NEY      an n-gram model with modified Kneser-Ney smoothing (see KneserNeyLM)
+class Smoothing(object):
+    LAPLACE    = 1
+    KNESER_NEY = 2
+
+# enums for cache eviction policies
+#
+#   LRU             a full cache evicts its least recently used entries
+#   FIFO            a full cache evicts its oldest entries, however often they were used
+class Evict(object):
+    LRU  = 1
+    FIFO = 2
+
+# ScoreCache
+#
+# a bounded memo table with hit and miss counters; used to memoize language model lookups across
+# expansions and across sentences without letting a long-running decoder grow without bound.
+# Each entry is stamped when it is added (and, for LRU, whenever it is used); when the cache is
+# full, the eighth of its entries with the oldest stamps is evicted at once, so eviction costs
+# O(log n) per insert on average and a hit only has to update a stamp
+
+class ScoreCache(object):
+
+    # init
+    #
+    # args:     max_size    the number of entries the cache holds
+    #           policy      the eviction policy (LRU or FIFO)
+
+    def __init__(self, max_size, policy=Evict.LRU):
+
+        if policy is not Evict.LRU and policy is not Evict.FIFO:
+            raise ValueError("Invalid eviction policy supplied.")
+
+        self.max_size = max_size
+        self.policy   = policy
+
+        # entries[key] = value, stamps[key] = the time the entry was added / last used
+        self.entries  = {}
+        self.stamps   = {}
+        self.clock    = itertools.count()
+        self.restamp  = policy is Evict.LRU
+
+        self.hits     = 0
+        self.misses   = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # get
+    #
+    # args:     key         the key to look up
+    #
+    # returns:  the cached value for key, or None if it is not cached
+
+    def get(self, key):
+
+        value = self.entries.get(key)
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if self.restamp:
+            self.stamps[key] = next(self.clock)
+
+        return value
+
+    # put
+    #
+    # args:     key         the key to cache value under
+    #           value       the value to cache (not None)
+    #
+    # returns:  none; caches the value, first evicting the oldest entries if the cache is full
+
+    def put(self, key, value):
+
+        if key not in self.entries and len(self.entries) >= self.max_size:
+
+            stamps = self.stamps
+            for old_key in heapq.nsmallest(max(1, self.max_size // 8), stamps, key=stamps.get):
+                del self.entries[old_key]
+                del stamps[old_key]
+
+        self.entries[key] = value
+        self.stamps[key]  = next(self.clock)
+
+    # hit_rate
+    #
+    # args:     none
+    #
+    # returns:  the fraction of lookups that were found in the cache (0 before any lookup)
+
+    def hit_rate(self):
+
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    # clear
+    #
+    # args:     none
+    #
+    # returns:  none; empties the cache and resets its counters
+
+    def clear(self):
+
+        self.entries.clear()
+        self.stamps.clear()
+        self.hits   = 0
+        self.misses = 0
+
+# TranslationOption
+#
+# one way of translating a span of the source sentence; the options of a sentence are built and 
+# scored once per sentence (see BeamSearch.translation_lattice) and shared by every hypothesis 
+# that uses them
+#
+# fields:   english         the translated phrase (a tuple of word ids)
+#           foreign         the original foreign phrase (a tuple of word ids)
+#           span            (start, end) indices of the foreign phrase in the source sentence
+#           mask            bitmask of the source words in span
+#           score           the (log) translation probability of the phrase pair
+#           estimate        score plus the language model estimate of english on its own (used
+#                           for the future cost table)
+#           lm_score        the (log) language model score of the words of english whose context
+#                           lies entirely inside english (see BeamSearch.phrase_lm)
+#           lm_state        the language model state after english, or None if it depends on
+#                           the words before the phrase
+
+class TranslationOption(object):
+
+    __slots__ = ('english', 'foreign', 'span', 'mask', 'score', 'estimate', 'lm_score', 
+                 'lm_state')
+
+    def __init__(self, english, foreign, span, mask, score, estimate, lm_score=0.0,
+                 lm_state=None):
+
+        self.english  = english
+        self.foreign  = foreign
+        self.span     = span
+        self.mask     = mask
+        self.score    = score
+        self.estimate = estimate
+        self.lm_score = lm_score
+        self.lm_state = lm_state
+
+# Hypothesis
+#
+# a single entry in a hypothesis stack; __slots__ keeps every record down to these fields (no
+# per-instance dict), since one is created for each expansion considered during a decode
+#
+# fields:   option          the TranslationOption applied by this hypothesis
+#           coverage        bitmask of the translated source words (bit i set once word i is
+#                           covered)
+#           num_covered     number of set bits in coverage
+#           cost            the present cost of the hypothesis
+#           score           the score of the hypothesis (present cost plus future cost)
+#           back            backpointer (the hypothesis this one was expanded from)
+#           state           the search state of the hypothesis; hypotheses with the same state
+#                           score every future expansion identically (see recombination_state)
+#           lm_state        the language model state after the hypothesis's English words
+#           recombined      the hypotheses that were recombined into this one (only recorded
+#                           when the stack keeps them, otherwise None)
+
+class Hypothesis(object):
+
+    __slots__ = ('option', 'coverage', 'num_covered', 'cost', 'score', 'back', 'state', 
+                 'lm_state', 'recombined')
+
+    def __init__(self, option, coverage, num_covered, cost, score, back, state=None,
+                 lm_state=None):
+
+        self.option      = option
+        self.coverage    = coverage
+        self.num_covered = num_covered
+        self.cost        = cost
+        self.score       = score
+        self.back        = back
+        self.state       = state
+        self.lm_state    = lm_state
+        self.recombined  = None
+
+    # hypotheses are ordered by score, so that a HypothesisStack can keep them in a heap
+    def __lt__(self, other):
+        return self.score < other.score
+
+# HypothesisStack
+#
+# a bounded hypothesis stack, kept as a min-heap on score so that the worst hypothesis is always
+# at the top of the heap: inserting costs O(log k) and the hypothesis to evict is found in O(1),
+# instead of re-sorting the whole stack on every insert
+#
+# since hypotheses point directly at the hypothesis they were expanded from, reordering the heap
+# (or evicting from it) never invalidates a backpointer
+#
+# with recombination on, the stack holds at most one hypothesis per search state: a hypothesis 
+# that arrives with the state of one already on the stack only survives if it scores better, and
+# the loser is (optionally) recorded on the winner. A replaced hypothesis is left in the heap as a 
+# dead entry and discarded once it reaches the top, so recombining stays O(log k)
+
+class HypothesisStack(object):
+
+    # init
+    #
+    # args:     prune               the pruning method (THRESHOLD or HISTOGRAM)
+    #           pthresh             the pruning threshold: the number of hypotheses to keep
+    #                               (HISTOGRAM), or the beam width (THRESHOLD), i.e. how far 
+    #                               below the best hypothesis's (log) score a hypothesis may be
+    #           recombine           whether to recombine hypotheses with the same state
+    #           keep_recombined     whether to record recombined hypotheses on the winner (for
+    #                               n-best / lattice output)
+    #           beam                (OPTIONAL) a beam width to apply on top of HISTOGRAM pruning
+
+    def __init__(self, prune, pthresh, recombine=False, keep_recombined=False, beam=None):
+
+        if prune is Prune.HISTOGRAM:
+            (self.capacity, self.beam) = (pthresh, beam)
+        elif prune is Prune.THRESHOLD:
+            (self.capacity, self.beam) = (None, pthresh)
+        else:
+            raise ValueError("Invalid pruning metric supplied.")
+
+        self.recombine       = recombine
+        self.keep_recombined = keep_recombined
+
+        self._heap   = []
+        self._states = {}       # _states[state] = live hypothesis with that state
+        self._size   = 0        # number of live hypotheses in the heap
+        self._best   = None
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (hyp for hyp in self._heap if self._live(hyp))
+
+    # push
+    #
+    # args:     hyp         the hypothesis to insert
+    #
+    # returns:  True if the hyp was added to the stack, False if it was pruned right away (or
+    #           recombined into a better hypothesis with the same state)
+
+    def push(self, hyp):
+
+        if self.recombine:
+            other = self._states.get(hyp.state)
+            if other is not None:
+                return self._recombine(other, hyp)
+
+        if not self.admits(hyp.score):
+            return False
+
+        # the stack is full: the hyp replaces the worst entry (which it beats, as it was admitted)
+        if self.capacity is not None and self._size >= self.capacity:
+            worst = heapq.heapreplace(self._heap, hyp)
+            self._size -= 1
+            self._forget(worst)
+            self._add(hyp, pushed=True)
+
+        else:
+            self._add(hyp)
+
+        # a new best hypothesis raises the threshold for everything already on the stack
+        if self.beam is not None and self._best is hyp:
+            self.prune_stack()
+
+        return True
+
+    # admits
+    #
+    # args:     score       the score of a prospective hypothesis
+    #
+    # returns:  whether a hypothesis with the given score would currently be kept on the stack
+    #           (ignoring recombination); used to reject candidates before they are inserted, or
+    #           even fully scored
+
+    def admits(self, score):
+
+        if self.beam is not None and self._best is not None:
+            if score < self._best.score - self.beam:
+                return False
+
+        if self.capacity is not None and self._size >= self.capacity:
+            self._drop_dead()
+            return self._heap[0].score < score
+
+        return True
+
+    # prune_stack
+    #
+    # args:     none
+    #
+    # returns:  none; drops entries from the top of the heap while they fall outside the beam
+
+    def prune_stack(self):
+
+        heap      = self._heap
+        threshold = self._best.score - self.beam
+
+        self._drop_dead()
+
+        while heap and heap[0].score < threshold:
+            self._size -= 1
+            self._forget(heapq.heappop(heap))
+            self._drop_dead()
+
+    # _recombine
+    #
+    # args:     other       the live hypothesis on the stack with the same state as hyp
+    #           hyp         the incoming hypothesis
+    #
+    # returns:  True if hyp replaced other on the stack, False if it was recombined into other
+
+    def _recombine(self, other, hyp):
+
+        (winner, loser) = (hyp, other) if other < hyp else (other, hyp)
+
+        if self.keep_recombined:
+            winner.recombined = (winner.recombined or []) + [loser] + (loser.recombined or [])
+            loser.recombined  = None
+
+        if winner is other:
+            return False
+
+        # the replaced hypothesis stays in the heap, dead, until it surfaces at the top
+        self._states[hyp.state] = hyp
+        heapq.heappush(self._heap, hyp)
+
+        if self._best < hyp:
+            self._best = hyp
+            if self.beam is not None:
+                self.prune_stack()
+
+        return True
+
+    def _add(self, hyp, pushed=False):
+
+        if not pushed:
+            heapq.heappush(self._heap, hyp)
+
+        self._size += 1
+
+        if self.recombine:
+            self._states[hyp.state] = hyp
+
+        if self._best is None or self._best < hyp:
+            self._best = hyp
+
+    def _forget(self, hyp):
+
+        if self.recombine and self._states.get(hyp.state) is hyp:
+            del self._states[hyp.state]
+
+    def _live(self, hyp):
+
+        return not self.recombine or self._states.get(hyp.state) is hyp
+
+    def _drop_dead(self):
+
+        heap = self._heap
+        while heap and not self._live(heap[0]):
+            heapq.heappop(heap)
+
+    # best
+    #
+    # args:     none
+    #
+    # returns:  the best hypothesis within the stack (None if the stack is empty)
+
+    def best(self):
+
+        return self._best
+
+# KBest
+#
+# lazy k-best extraction (Huang & Chiang, "Better k-best Parsing", algorithm 3) over the search 
+# graph left behind by a decode. The incoming arcs of a hypothesis are the hypothesis itself and
+# every hypothesis recombined into it, each leading back to its own backpointer; the final stack
+# hangs off a virtual root. The j-th best derivation of a hypothesis is only worked out once
+# something asks for it, so extracting the 100-best costs little more than the 1-best
+#
+# a derivation is stored as (score, arc index, rank of the derivation used at the arc's tail)
+
+class KBest(object):
+
+    # init
+    #
+    # args:     final_stack     the hypothesis stack to extract complete translations from
+
+    def __init__(self, final_stack):
+
+        self._finals = list(final_stack)
+        self._arcs   = {}       # _arcs[node]   = [(arc cost, tail, hypothesis), ...]
+        self._derivs = {}       # _derivs[node] = derivations found so far, best first
+        self._cands  = {}       # _cands[node]  = heap of candidate derivations
+        self._next   = {}       # _next[node]   = number of derivations whose successors are queued
+
+    # nbest
+    #
+    # args:     k           the number of derivations to extract
+    #
+    # returns:  up to k (derivation, score) pairs, best first, where each derivation is the list
+    #           of hypotheses whose phrases make up the translation, in order (see derivation)
+
+    def nbest (self, k):
+
+        derivs = self._kth_best(None, k - 1)
+
+        return [(self.derivation(rank), derivs[rank][0]) for rank in range(min(k, len(derivs)))]
+
+    # derivation
+    #
+    # args:     rank        the rank of a derivation of the virtual root
+    #
+    # returns:  the hypotheses along the derivation, first phrase first; each one's backpointer
+    #           shares the search state of the hypothesis before it (the two were recombined,
+    #           if they differ), so it scores the phrase as the derivation does
+
+    def derivation (self, rank):
+
+        hyps = []
+        node = None
+
+        while True:
+
+            (_, arc, tail_rank) = self._derivs[node][rank]
+            if arc is None:
+                break
+
+            (_, tail, hyp) = self._arcs[node][arc]
+            if hyp is not None:
+                hyps.append(hyp)
+
+            (node, rank) = (tail, tail_rank)
+
+        return list(reversed(hyps))
+
+    # _incoming
+    #
+    # args:     node        a hypothesis, or None for the virtual root
+    #
+    # returns:  the incoming arcs of the node, as (arc cost, tail, hypothesis) triples
+
+    def _incoming (self, node):
+
+        # the root's arcs add each final hypothesis's future cost (nonzero only when some words
+        # could not be translated), so the best derivation scores like best_cand
+        if node is None:
+            return [(hyp.score - hyp.cost, hyp, None) for hyp in self._finals]
+
+        return [(hyp.cost - hyp.back.cost, hyp.back, hyp) 
+                for hyp in [node] + (node.recombined or [])]
+
+    # _kth_best
+    #
+    # args:     node        a hypothesis, or None for the virtual root
+    #           k           the (0-based) rank of the derivation needed
+    #
+    # returns:  the derivations of the node found so far, extended (if possible) to hold its
+    #           k-th best derivation
+
+    def _kth_best (self, node, k):
+
+        derivs = self._derivs.get(node)
+
+        if derivs is None:
+
+            # base case: the null hypothesis has a single, empty derivation
+            if node is not None and node.back is None:
+                derivs = self._derivs[node] = [(0.0, None, None)]
+                return derivs
+
+            arcs  = self._arcs[node] = self._incoming(node)
+            cands = self._cands[node] = []
+
+            for (arc, (cost, tail, _)) in enumerate(arcs):
+                tail_derivs = self._kth_best(tail, 0)
+                if tail_derivs:
+                    cands.append((-(cost + tail_derivs[0][0]), arc, 0))
+
+            heapq.heapify(cands)
+            derivs = self._derivs[node] = []
+            self._next[node] = 0
+
+        if node not in self._cands:
+            return derivs
+
+        arcs  = self._arcs[node]
+        cands = self._cands[node]
+
+        while len(derivs) <= k:
+
+            # queue the successor of the last derivation taken: the same arc, with the next
+            # best derivation of its tail
+            if self._next[node] < len(derivs):
+
+                (_, arc, tail_rank) = derivs[-1]
+                (cost, tail, _)     = arcs[arc]
+
+                tail_derivs = self._kth_best(tail, tail_rank + 1)
+                if len(tail_derivs) > tail_rank + 1:
+                    heapq.heappush(cands, (-(cost + tail_derivs[tail_rank + 1][0]), 
+                                           arc, tail_rank + 1))
+
+                self._next[node] = len(derivs)
+
+            if not cands:
+                break
+
+            (neg_score, arc, tail_rank) = heapq.heappop(cands)
+            derivs.append((-neg_score, arc, tail_rank))
+
+        return derivs
 
 class BeamSearch: 
 
     # init
     #
-    # args:     translation_table   dict, takes a first key (the word) and return a list of
-    #                               all possible translations for that first key
+    # args:     training_set        a training set (English) with which to construct the LM
+    #           translation_table   dict, takes a first key (the word) and return a list of
+    #                               all possible translations for that first key (or a
+    #                               PhraseTable loaded from a binary table)
     #           prune               the pruning method (THRESHOLD or HISTOGRAM)
-    #           pthresh             the pruning threshold
+    #           pthresh             the pruning threshold: the number of hypotheses kept per 
+    #                               stack (HISTOGRAM), or the beam width in log probability 
+    #                               below the best hypothesis of the stack (THRESHOLD)
+    #           beam                (OPTIONAL) a beam width to combine with HISTOGRAM pruning
+    #           recombine           whether to recombine hypotheses that share a search state
+    #                               (see recombination_state)
+    #           keep_recombined     whether to keep the recombined (losing) hypotheses on the
+    #                               winning hypothesis, e.g. for n-best or lattice output
+    #           dlimit              the distortion limit: the furthest (in source words) a phrase
+    #                               may start from the end of the previous phrase; None allows
+    #                               any reordering
+    #           decode              the decoding method (STACK or CUBE_PRUNING)
+    #           vocab               (OPTIONAL) the Vocabulary that translation_table is already 
+    #                               interned in (see get_word_translations); if not given, the
+    #                               table is interned in a new Vocabulary here. A model trained
+    #                               here spans every word of a given vocabulary, source words
+    #                               included
+    #           smoothing           the language model smoothing (LAPLACE or KNESER_NEY)
+    #           lm_order            the order of the language model when smoothing is KNESER_NEY
+    #                               (the LAPLACE model is always a bigram model)
+    #           lm                  (OPTIONAL) a pre-built language model (e.g. a loaded
+    #                               FrozenBigramLM) to use instead of training one on 
+    #                               training_set, which may then be None
+    #           lm_cache            (OPTIONAL) a directory of saved LAPLACE models, keyed by a
+    #                               fingerprint of their training set; the model is loaded from
+    #                               it if present, and trained and saved to it otherwise
+    #           cache_size          the number of language model lookups memoized by
+    #                               transition_prob (0 or None turns the cache off)
+    #           cache_policy        the eviction policy of the cache (LRU or FIFO)
+    #           quantize            (OPTIONAL) a number of bits (1 to 16): if given, the scores
+    #                               of the language model and the translation table are
+    #                               quantized to that many bits (see quantize.py), trading a
+    #                               little accuracy for memory; the decoder quantizes copies,
+    #                               and a dict table is compiled into a packed PhraseTable
+    #
+    # notes:    a pre-built or cached model brings its own Vocabulary, so the translation table
+    #           is interned in it: vocab may only be given if it is the model's vocabulary
 
     def __init__(self, training_set, translation_table, 
-                 prune=Prune.HISTOGRAM, pthresh=5):
+                 prune=Prune.HISTOGRAM, pthresh=5, recombine=True, keep_recombined=False,
+                 dlimit=None, decode=Decode.STACK, beam=None, vocab=None,
+                 smoothing=Smoothing.LAPLACE, lm_order=3, lm=None, lm_cache=None,
+                 cache_size=100000, cache_policy=Evict.LRU, quantize=None):
+
+        if decode is not Decode.STACK and decode is not Decode.CUBE_PRUNING:
+            raise ValueError("Invalid decoding method supplied.")
+
+        if smoothing is not Smoothing.LAPLACE and smoothing is not Smoothing.KNESER_NEY:
+            raise ValueError("Invalid smoothing method supplied.")
+
+        self.smoothing = smoothing
+        self.lm_order  = lm_order
+
+        if lm is None and lm_cache is not None:
 
+            if smoothing is not Smoothing.LAPLACE:
+                raise ValueError("Only LAPLACE language models can be cached.")
+
+            lm = self.cached_lm(training_set, lm_cache)
+
+        # words are interned once, up front: the language model and the translation table share
+        # a vocabulary, and decoding only handles word ids
+        if vocab is None:
+            vocab = lm.vocab if lm is not None else Vocabulary()
+            self.vocab = vocab
+
+            # the words a model trained here can predict (the English side of the table and
+            # its training words) take the first ids, and the model is trained before the
+            # source phrases are interned: its distributions and arrays then only span those
+            # words, and source ids lie past its range (unknown to it)
+            if lm is None:
+
+                if isinstance(translation_table, PhraseTable):
+                    vocab.encode(translation_table.EnglishWords(), add=True)
+                else:
+                    vocab.encode(english_words(translation_table), add=True)
+
+                lm = self.create_lm(training_set)
+
+            if isinstance(translation_table, PhraseTable):
+                translation_table = translation_table.Intern(vocab)
+            else:
+                translation_table = intern_translations(translation_table, vocab)
+
+        elif lm is not None and lm.vocab is not vocab:
+            raise ValueError("The translation table must be interned in the LM's vocabulary.")
+
+        self.vocab = vocab
         self.all_translations = translation_table
         
-        # populate the language model using the training_set
-        self.transitions = self.create_bigram_lm(training_set)
+        # populate the language model using the training_set, unless one was supplied
+        self.transitions = lm if lm is not None else self.create_lm(training_set)
+
+        # store the scores in quantized form, if asked to; the model and table are quantized
+        # in (shallow) copies, so a model or table the caller passed in is left as it was
+        if quantize:
+
+            self.transitions = copy.copy(self.transitions)
+            self.transitions.Quantize(quantize)
+
+            if isinstance(self.all_translations, PhraseTable):
+                self.all_translations = copy.copy(self.all_translations)
+            else:
+                self.all_translations = PhraseTable(self.all_translations, vocab)
+
+            self.all_translations.Quantize(quantize)
+
+        # the source phrases of the table, indexed for prefix walks (see translation_lattice);
+        # a binary table's sorted source index serves as its own
+        if isinstance(self.all_translations, PhraseTable):
+            self.source_index = self.all_translations
+        else:
+            self.source_index = PhraseTrie(self.all_translations)
+
+        # phrase_lm_cache[english phrase] = the phrase's language model scores (see phrase_lm)
+        self.phrase_lm_cache = {}
+
+        # memoized boundary lookups of transition_prob, kept across sentences
+        if cache_size:
+            self.transition_cache = ScoreCache(cache_size, cache_policy)
+        else:
+            self.transition_cache = None
         
         # set the beam search's pruning settings
         self.prune        = prune
         self.pthresh      = pthresh
+        self.beam         = beam
+
+        # set the beam search's recombination settings
+        self.recombine       = recombine
+        self.keep_recombined = keep_recombined
+
+        # set the beam search's reordering settings
+        self.dlimit          = dlimit
+
+        # set the beam search's decoding method
+        self.decode          = decode
+
+    # create_lm
+    #
+    # args:     training_set        a training set (English) with which to construct the LM
+    # 
+    # returns:  a language model for English, trained on the training set with the decoder's
+    #           smoothing method
+
+    def create_lm (self, training_set):
+
+        if self.smoothing is Smoothing.KNESER_NEY:
+            model = KneserNeyLM(self.lm_order, self.vocab)
+            model.EstimateNGrams(training_set)
+            return model
+
+        return self.create_bigram_lm(training_set)
 
     # create_bigram_lm
     #
     # args:     training_set        a training set (English) with which to construct the LM
     # 
-    # returns:  returns a language model for English, trained on the training set, as well as
-    #           a weight for unigrams and bigrams, assessed through deleted interpolation
+    # returns:  returns a language model for English, trained on the training set and frozen
+    #           (see FrozenBigramLM), since the decoder only reads from it
 
     def create_bigram_lm (self, training_set):
 
-        model = BigramLM()
+        model = BigramLM(self.vocab)
         model.EstimateBigrams(training_set) 
+        return model.freeze()
+
+    # cached_lm
+    #
+    # args:     training_set        a training set (English) with which to construct the LM
+    #           lm_cache            the directory of saved models
+    # 
+    # returns:  the (frozen) bigram language model for the training set: memory-mapped from
+    #           lm_cache if it was saved there before, otherwise trained and then saved there
+
+    def cached_lm (self, training_set, lm_cache):
+
+        file_name = os.path.join(lm_cache, "bigram-%s.lm" % corpus_fingerprint(training_set))
+
+        model = FrozenBigramLM()
+
+        if os.path.exists(file_name):
+            model.Load(file_name)
+            return model
+
+        trained = BigramLM()
+        trained.EstimateBigrams(training_set)
+        model = trained.freeze()
+
+        if not os.path.isdir(lm_cache):
+            os.makedirs(lm_cache)
+
+        model.Save(file_name)
         return model
 
     # transition_prob
     #
-    # args:     prev_word           the first word in the word pair
-    #           word                the second word in the word pair
+    # args:     lm_state            the language model state before the phrase
+    #           option              the TranslationOption being applied
     # 
-    # returns:  returns the probability of the second word given the first, using simple
-    #           linear interpolation for smoothing
+    # returns:  (log probability of the option's English phrase given lm_state, the language
+    #           model state after the phrase); only the first order - 1 words (one lookup, for
+    #           the bigram model) are scored here, the rest is the option's cached lm_score
+    #
+    # notes:    the lookups of the first words are memoized in transition_cache, since many
+    #           hypotheses (with the same LM state) are extended with the same words
+
+    def transition_prob (self, lm_state, option):
 
-    def transition_prob (self, prev_word, word):
+        head  = self.transitions.order - 1
+        words = option.english[:head]
+        cache = self.transition_cache
 
-        return self.transitions.LogProb_Laplace(prev_word, word)        
+        boundary = cache.get((lm_state, words)) if cache is not None else None
 
-    # relevant_translations
+        if boundary is None:
+            boundary = self.transitions.ScorePhrase(words, lm_state)
+            if cache is not None:
+                cache.put((lm_state, words), boundary)
+
+        (transition_p, lm_state) = boundary
+
+        if option.lm_state is not None:
+            lm_state = option.lm_state
+
+        return (transition_p + option.lm_score, lm_state)
+
+    # translation_lattice
     #
-    # args:     source_sent         the foreign language sentence (to translate)
-    #           translation_table   dict, takes a first key (the word) and return a list of
-    #                               all possible translations for that first key (determined from
-    #                               the training set)
+    # args:     none (uses the source-sentence-dependent class elements)
+    #
+    # returns:  the translation options of the sentence, indexed by source span: lattice[start] is
+    #           a list of (end, options) pairs, in order of increasing end, holding the scored
+    #           TranslationOptions for every span (start, end) that has a translation
     #
-    # returns:  a dict in the same format of translation_table, but only with the phrases in
-    #           source_sent
+    # notes:    every phrase of the sentence is looked up here, once, so that expanding
+    #           hypotheses only has to walk the lattice; the phrases are found by walking the
+    #           table's prefix trie (source_index) from each start position, and a walk stops as
+    #           soon as no longer phrase can match
 
-    def relevant_translations(self, source_sent):
+    def translation_lattice (self):
 
-        translations = collections.defaultdict(lambda: collections.defaultdict(float))
+        lattice = []
 
-        # consider all possible combinations of phrases in the source sentence, adding them
-        # to our translations table if a translation for that phrase has been seen before
-        for (i, word) in enumerate(self.source_sent, start=0):
-            
-            curr_phrase = ""
+        # collect every phrase of the source sentence that has a translation, by walking the
+        # prefix trie from each start position
+        for start in range(self.num_words):
 
-            for j in range(i, self.num_words):
+            spans = []
 
-                if j is i:
-                    curr_phrase = self.source_sent[j]
-                else:
-                    curr_phrase += " " + self.source_sent[j]
+            for (end, translations) in self.source_index.matches(self.source_ids, start):
+
+                curr_phrase = self.source_ids[start:end]
+
+                span    = (start, end)
+                mask    = ((1 << (end - start)) - 1) << start
+                options = []
 
-                if curr_phrase in self.all_translations:
+                for (trans, translation_p) in translations.items():
+                    (lm_estimate, lm_score, lm_state) = self.phrase_lm(trans)
+                    options.append(TranslationOption(trans, curr_phrase, span, mask,
+                                                     translation_p, translation_p + lm_estimate,
+                                                     lm_score, lm_state))
 
-                    for trans in self.all_translations[curr_phrase]:
-                        translations[curr_phrase][trans] = self.all_translations[curr_phrase][trans]
+                # options are kept best first (by estimate), as cube pruning expects
+                if options:
+                    options.sort(key=lambda option: option.estimate, reverse=True)
+                    spans.append((end, options))
 
-        return translations
+            lattice.append(spans)
+
+        return lattice
 
     # translate
     #
@@ -147,252 +880,454 @@ class BeamSearch:
 
     def translate (self, source_sent):
 
+        self.search(source_sent)
+
+        translation = self.backtrace(self.best_cand(self.final_stack()))
+
+        if translation != "No translation found.":
+            return translation.split()
+
+        return translation
+
+    # translate_nbest
+    #
+    # args:     source_sent     the source (foreign) sentence
+    #           k               the number of translations to return
+    #
+    # returns:  up to k (translated sentence, features, score) triples, best first, taken from a
+    #           single decode of the sentence, where features breaks the score down (see
+    #           features)
+    #
+    # notes:    the alternatives come from the hypotheses that were recombined during the decode
+    #           (which are kept for this decode regardless of keep_recombined), and from the 
+    #           other hypotheses in the final stack
+
+    def translate_nbest (self, source_sent, k):
+
+        keep_recombined = self.keep_recombined
+        self.keep_recombined = True
+
+        try:
+            self.search(source_sent)
+        finally:
+            self.keep_recombined = keep_recombined
+
+        final_stack = self.final_stack()
+
+        # only the null hypothesis: nothing was translated
+        if final_stack is self.hyp_stacks[0]:
+            return []
+
+        return [(self.vocab.decode([word for hyp in derivation for word in hyp.option.english]),
+                 self.features(derivation), score)
+                for (derivation, score) in KBest(final_stack).nbest(k)]
+
+    # features
+    #
+    # args:     derivation      the hypotheses of a complete translation, first phrase first (see
+    #                           KBest.derivation)
+    #
+    # returns:  the (name, value) pairs of the (log) feature scores that add up to its score:
+    #           the translation model ("TM0"), the language model ("LM0"), the distortion model
+    #           ("Distortion0") and the future cost of the source words left untranslated
+    #           ("Untranslated0")
+
+    def features (self, derivation):
+
+        (tm, lm, distortion) = (0.0, 0.0, 0.0)
+
+        for hyp in derivation:
+
+            tm = tm + hyp.option.score
+            lm = lm + self.transition_prob(hyp.back.lm_state, hyp.option)[0]
+
+            if hyp.back.option.english is not None:
+                distortion = distortion + log(self.distortion(hyp))
+
+        # the future cost of the final hypothesis (nonzero only when words were left out)
+        untranslated = derivation[-1].score - derivation[-1].cost
+
+        return [("TM0", tm), ("LM0", lm), ("Distortion0", distortion),
+                ("Untranslated0", untranslated)]
+
+    # final_stack
+    #
+    # args:     none (uses the source-sentence-dependent class elements)
+    #
+    # returns:  the hypothesis stack the translations of the sentence are taken from: the stack
+    #           of the hypotheses that cover every word some phrase can translate (NULL
+    #           included), or, if the search never got that far, the fullest non-empty stack
+    #           before it
+
+    def final_stack (self):
+
+        translatable = bin(self.full_mask & ~self.untranslatable).count("1")
+
+        for i in range(translatable, 0, -1):
+            if len(self.hyp_stacks[i]) > 0:
+                return self.hyp_stacks[i]
+
+        return self.hyp_stacks[0]
+
+    # search
+    #
+    # args:     source_sent     the source (foreign) sentence
+    #
+    # returns:  none; fills the hypothesis stacks for the sentence
+
+    def search (self, source_sent):
+
         # convert all the words in the sentence to lowercase and add NULL to the beginning of 
         # the sentence
-        source_sent = [word.lower() for word in source_sent]
-        source_sent.insert(0, "NULL")
+        source_sent = decoder_input(source_sent)
 
-        # populate the source-sentence-dependent class elements
+        # populate the source-sentence-dependent class elements (words the vocabulary has 
+        # never seen are encoded as None)
         self.source_sent  = source_sent
+        self.source_ids   = self.vocab.encode(source_sent)
         self.num_words    = len(source_sent)
-        # self.hyp_stacks   = [[]] * self.num_words
-        self.hyp_stacks = [[] for _ in range(self.num_words + 1)]
-        self.translations = self.relevant_translations(source_sent)
+        self.full_mask    = (1 << self.num_words) - 1
+        self.hyp_stacks   = [HypothesisStack(self.prune, self.pthresh, 
+                                             self.recombine, self.keep_recombined, self.beam)
+                             for _ in range(self.num_words + 1)]
+        self.lattice      = self.translation_lattice()
+        self.future_costs = self.future_cost_table()
+
+        # words that no translation option covers can never be translated, so they are never
+        # counted as gaps when enforcing the distortion limit
+        self.untranslatable = self.full_mask
+        for spans in self.lattice:
+            for (_, options) in spans:
+                self.untranslatable &= ~options[0].mask
 
-        # Tuple structure for candidates (that populate hypothesis stacks):
-        #
-        #   [0] new translated phrase
-        #   [1] [0] original foreign word(s)
-        #       [1] start index of the translated phrase
-        #   [2] [0] marked words (list of booleans)
-        #       [1] number of marked words
-        #   [3] score
-        #   [4] backpointer
+        # every candidate in the hypothesis stacks is a Hypothesis record; the null hypothesis
+        # covers nothing (ending at the start of the sentence) and has no backpointer
+        null_option = TranslationOption(None, None, (0, 0), 0, 0.0, 0.0)
+        null_cand   = Hypothesis(null_option, 0, 0, 0.0, 0.0, None,
+                                 lm_state=self.transitions.BeginState())
 
-        null_trans = None
-        null_orig  = (None, None)
-        null_marks = ([False] * self.num_words, 0)
-        null_score = None
-        null_bkptr = None
-        null_cand  = (null_trans, null_orig, null_marks, null_score, null_bkptr) 
+        self.hyp_stacks[0].push(null_cand)
 
-        self.hyp_stacks[0].append(null_cand)
+        if self.decode is Decode.CUBE_PRUNING:
 
-        for i in range(0, self.num_words + 1):
+            # stacks are filled in order, each one from the (finished) stacks before it
+            groups = []
 
-            for (j, hyp) in enumerate(self.hyp_stacks[i], start=0):
+            for i in range(1, self.num_words + 1):
 
-                # tuple pointing to the current location of the candidate to expand
-                # (to use as backpointer for expansions of the candidate)
-                curr_loc = (i, j)
+                groups.append(self.cube_groups(self.hyp_stacks[i - 1]))
+                self.cube_prune(i, groups)
 
-                for new_cand in self.expansions(hyp, curr_loc):
+        else:
 
-                    new_cand_len = new_cand[2][1]
+            for i in range(0, self.num_words + 1):
 
-                    self.hyp_stacks[new_cand_len] = self.insert_hyp(new_cand, 
-                                                                    self.hyp_stacks[new_cand_len], 
-                                                                    self.prune, self.pthresh)
+                for hyp in self.hyp_stacks[i]:
 
-        for i in range(self.num_words - 1, -1, -1):
-            translation = self.backtrace(self.best_cand(self.hyp_stacks[i]))
-            if translation != "No translation found.":
-                return translation.split()
+                    for new_cand in self.expansions(hyp):
 
-        return "No translation found."
+                        self.insert_hyp(new_cand, self.hyp_stacks[new_cand.num_covered])
 
     # expansions
     #
     # args:     hyp         the hypothesis to expand
-    #           loc         a tuple containing the stack number and index within that stack for
-    #                       the current hypothesis
-    #           source      the source sentence          
     #
-    # returns:  a list of possible new hypotheses
+    # returns:  a list of possible new hypotheses (leaving out the ones their stack would not
+    #           admit anyway)
 
-    def expansions (self, hyp, loc):
+    def expansions (self, hyp):
 
         exps = []
 
-        # cand  =   [0] new translated phrase
-        #           [1] [0] original foreign word(s)
-        #               [1] start index (index of first orig. word in foreign sentence)
-        #           [2] [0] marked words (list of booleans)
-        #               [1] number of marked words
-        #           [3] score
-        #           [4] backpointer
+        for options in self.applicable_options(hyp):
 
-        curr_word    = hyp[0]
-        curr_foreign = hyp[1][0]
-        curr_marked  = hyp[2][0]
-        curr_len     = hyp[2][1]
-        curr_score   = hyp[3]
-        curr_loc     = loc           # the location of the current cand within the hyp_stacks
+            # every option for the span leaves the same words uncovered
+            (start, end) = options[0].span
+            future       = self.future_cost(hyp.coverage | options[0].mask)
+            hyp_stack    = self.hyp_stacks[hyp.num_covered + (end - start)]
 
-        for (index, word_slot) in enumerate(curr_marked, start=0):
+            for option in options:
 
-            # the word in the index has already been translated previously
-            if word_slot is True:
-                continue
+                # distortion and transition scores are log probabilities (never above 0), so 
+                # this bounds the expansion's score; skip the scoring if even that is pruned
+                if not hyp_stack.admits(hyp.cost + option.score + future):
+                    continue
 
-            # the word in the index still needs translation
-            else:
+                exp = self.create_expansion(option, hyp, future)
 
-                curr_phrase = ""
+                if hyp_stack.admits(exp.score):
+                    exps.append(exp)
 
-                # for all possible phrases starting with that word, if the phrase is in the 
-                # translation table, create an expansion using the phrase
+        return exps
 
-                for phrase_end in range(index, self.num_words):
+    # applicable_options
+    #
+    # args:     hyp         the hypothesis to expand
+    #
+    # returns:  a generator over the lists of translation options (one list per source span, as
+    #           stored in the lattice) that can be applied to the hypothesis
 
-                    if curr_marked[phrase_end] is True:
-                        break
+    def applicable_options (self, hyp):
 
-                    if phrase_end is index:
-                        curr_phrase = self.source_sent[phrase_end]
-                    else:
-                        curr_phrase = curr_phrase + " " + self.source_sent[phrase_end]
+        curr_covered = hyp.coverage
 
-                    if curr_phrase in self.translations:
+        # visit only the words that still need translation, lowest index first
+        uncovered = ~curr_covered & self.full_mask
 
-                        for poss_trans in self.translations[curr_phrase]:
-                            new_exp = self.create_expansion(poss_trans, index, phrase_end + 1,
-                                                            curr_marked, curr_len, curr_score, curr_loc)
-                            if new_exp is not None:
-                                exps.append(new_exp)
+        # with a distortion limit, only phrases starting within dlimit words of the end of the
+        # previous phrase are considered (measured from next_start, which skips untranslatable
+        # words right after the previous phrase)
+        if self.dlimit is not None:
+            prev_end  = self.next_start(hyp.option.span[1])
+            low       = max(prev_end - self.dlimit, 0)
+            high      = min(prev_end + self.dlimit, self.num_words - 1)
+            uncovered &= ((1 << (high - low + 1)) - 1) << low
 
-        return exps
+        while uncovered:
 
-    # create_expansion
+            lowest    = uncovered & -uncovered
+            uncovered = uncovered ^ lowest
+            index     = lowest.bit_length() - 1
+
+            # a phrase starting at index may run up to (but not into) the next translated word
+            above = curr_covered >> index
+            if above:
+                limit = index + (above & -above).bit_length() - 1
+            else:
+                limit = self.num_words
+
+            # all phrases starting with that word that have a translation
+            for (end, options) in self.lattice[index]:
+
+                if end > limit:
+                    break
+
+                if self.dlimit is not None and not self.reachable(curr_covered | options[0].mask,
+                                                                  index, end):
+                    continue
+
+                yield options
+
+    # cube_groups
+    #
+    # args:     hyp_stack   a finished hypothesis stack
     #
-    # args:    poss_trans    a translation of the given foreign phrase
-    #          index         the starting index of the foreign phrase
-    #          phrase_end    the ending index of the foreign phrase
-    #          curr_marked   the hypothesis's currently translated set of words
-    #          curr_len      "   "            number of currently translated words
-    #          curr_score    "   "            score
-    #          curr_loc      "   "            location within self.hyp_stacks
+    # returns:  the hypotheses of the stack grouped so that every hypothesis in a group can be
+    #           expanded with the same translation options: a list of (hyps, options_by_length)
+    #           pairs, where hyps is sorted best first and options_by_length maps a phrase length
+    #           to the lists of options applicable to the group
     #
-    # returns: an entry to add to one of the hypothesis stacks encapsulating the given information;
-    #          returns none in the event than no valid expansion can be created from the given
-    #          information
+    # notes:    hypotheses are grouped by coverage (and, with a distortion limit, by the end of
+    #           their last phrase, which decides the reachable spans)
 
-    def create_expansion (self, poss_trans, index, phrase_end, 
-                          curr_marked, curr_len, curr_score, curr_loc):
+    def cube_groups (self, hyp_stack):
 
-        exp_word    = poss_trans
+        groups = collections.defaultdict(list)
 
-        exp_foreign = ""
-        for i in range(index, phrase_end):
-            if i is index:
-                exp_foreign = self.source_sent[i]
+        for hyp in hyp_stack:
+            if self.dlimit is None:
+                groups[hyp.coverage].append(hyp)
             else:
-                exp_foreign = exp_foreign + " " + self.source_sent[i]
+                groups[(hyp.coverage, hyp.option.span[1])].append(hyp)
 
-        exp_index   = (index, phrase_end)
+        cube_groups = []
 
-        # while traversing through the marked array, ensure that none of the words in the phrase
-        # have been previously translated
-        exp_marked  = copy.deepcopy(curr_marked)
-        for i in range(index, phrase_end):
-            if exp_marked[i] is False:
-                exp_marked[i] = True
-            else:
-                return None
+        for hyps in groups.values():
+
+            hyps.sort(reverse=True)
+
+            options_by_length = collections.defaultdict(list)
+            for options in self.applicable_options(hyps[0]):
+                (start, end) = options[0].span
+                options_by_length[end - start].append(options)
+
+            cube_groups.append((hyps, options_by_length))
+
+        return cube_groups
+
+    # cube_prune
+    #
+    # args:     num_covered     the number of the stack to fill
+    #           groups          groups[i] holds the cube_groups of stack i, for every stack
+    #                           before num_covered
+    #
+    # returns:  none; fills self.hyp_stacks[num_covered]
+    #
+    # notes:    every (group, span) pair whose phrase length lands in the stack forms a "cube" of
+    #           the group's hypotheses (best first) against the span's options (best first). The
+    #           best corner of each cube is scored, and candidates are then taken best-first from
+    #           a priority queue, scoring each taken cell's two neighbours, until the stack no 
+    #           longer admits the best remaining candidate
+
+    def cube_prune (self, num_covered, groups):
+
+        hyp_stack = self.hyp_stacks[num_covered]
+        cubes     = []
+        queue     = []
+        seen      = set()
+        tiebreak  = itertools.count()
+
+        def push_cell(cube, i, j):
+
+            (hyps, options, future) = cubes[cube]
+
+            if i >= len(hyps) or j >= len(options) or (cube, i, j) in seen:
+                return
+
+            seen.add((cube, i, j))
+
+            exp = self.create_expansion(options[j], hyps[i], future)
+            heapq.heappush(queue, (-exp.score, next(tiebreak), exp, cube, i, j))
+
+        for prev_covered in range(num_covered):
+            for (hyps, options_by_length) in groups[prev_covered]:
+                for options in options_by_length.get(num_covered - prev_covered, ()):
+
+                    # the whole cube leaves the same words uncovered
+                    future = self.future_cost(hyps[0].coverage | options[0].mask)
+
+                    cubes.append((hyps, options, future))
+                    push_cell(len(cubes) - 1, 0, 0)
+
+        while queue:
+
+            (_, _, exp, cube, i, j) = heapq.heappop(queue)
+
+            if not hyp_stack.admits(exp.score):
+                break
+
+            self.insert_hyp(exp, hyp_stack)
+
+            push_cell(cube, i + 1, j)
+            push_cell(cube, i, j + 1)
+
+    # reachable
+    #
+    # args:    covered       the translated set of words (bitmask) after applying a phrase
+    #          start         the starting index of the applied phrase
+    #          end           the ending index of the applied phrase
+    #
+    # returns: whether the first untranslated word that is left behind the applied phrase can 
+    #          still be reached within the distortion limit, measured (as in applicable_options)
+    #          from next_start(end); if it cannot, the gap could never be filled
+
+    def reachable (self, covered, start, end):
+
+        gaps = ~(covered | self.untranslatable) & self.full_mask
+
+        if not gaps:
+            return True
+
+        first_gap = (gaps & -gaps).bit_length() - 1
+
+        return first_gap > start or self.next_start(end) - first_gap <= self.dlimit
+
+    # next_start
+    #
+    # args:    end           the ending index of a phrase
+    #
+    # returns: the position the distortion limit is measured from after the phrase: its end,
+    #          moved past any untranslatable words right after it (since no phrase can ever
+    #          start on them)
+
+    def next_start (self, end):
+
+        skipped = self.untranslatable >> end
+
+        return end + (~skipped & (skipped + 1)).bit_length() - 1
+
+    # create_expansion
+    #
+    # args:    option        the translation option to apply to the hypothesis; its source span
+    #                        must not overlap the words the hypothesis has already translated
+    #          curr_hyp      the hypothesis being expanded (the backpointer of the expansion)
+    #          [future]      (OPTIONAL) the future cost of the expansion, if already known
+    #
+    # returns: an entry to add to one of the hypothesis stacks encapsulating the given information
+
+    def create_expansion (self, option, curr_hyp, future=None):
 
-        exp_len     = curr_len + (phrase_end - index)
+        (start, end) = option.span
 
-        exp_bkptr   = curr_loc
+        exp_covered = curr_hyp.coverage | option.mask
+        exp_len     = curr_hyp.num_covered + (end - start)
 
-        # in the cand passed to the score function, the score of the candidate is
-        # left blank (this is the value to be calculated)
-        exp_score  = self.score((exp_word, 
-                                 (exp_foreign, exp_index),
-                                 (exp_marked, exp_len), 
-                                None,
-                                exp_bkptr),
-                                curr_score)
+        # in the cand passed to the score function, the cost and score of the candidate are
+        # left blank (these are the values to be calculated)
+        exp = Hypothesis(option, exp_covered, exp_len, None, None, curr_hyp)
+        (exp.cost, exp.score) = self.score(exp, curr_hyp.cost, future)
+        exp.state = self.recombination_state(exp)
 
-        return ((exp_word, 
-                    (exp_foreign, exp_index),
-                    (exp_marked, exp_len),
-                    exp_score,
-                    exp_bkptr))
+        return exp
+
+    # recombination_state
+    #
+    # args:     hyp         the hypothesis to find the search state of
+    #
+    # returns:  the parts of the hypothesis that later expansions are scored on: its coverage, 
+    #           its language model state (all transition_prob looks at) and the end of its 
+    #           source phrase (all distortion looks at). Two hypotheses with the same state
+    #           cannot diverge in future score, so only the better one needs to be kept
+
+    def recombination_state (self, hyp):
+
+        return (hyp.coverage, hyp.lm_state, hyp.option.span[1])
 
     # insert_hyp
     # 
     # args:     hyp         the hypothesis to insert
     #           hypStack    the hypothesis stack to insert the hypothesis into
-    #           prune       the pruning method (THRESHOLD or HISTOGRAM)
-    #           pthresh     the pruning threshold
-    #
-    # returns:  the hypothesis stack, with the hyp added (if it meets the pruning threshold)
     #
-    # notes:    hypStacks invariant: a hypothesis stack is always in sorted order (where index 0 has 
-    #           the lowest priority)
+    # returns:  True if the hyp was added to the stack (i.e. it meets the stack's pruning 
+    #           threshold), False otherwise
 
-    def insert_hyp (self, hyp, hypStack, prune, pthresh):
+    def insert_hyp (self, hyp, hypStack):
 
-        hypStack.append(hyp)
-        hypStack.sort(key=lambda tup: tup[3])
-
-        # prune the stack as needed and return the new stack
-        return self.prune_stack(hypStack, prune, pthresh)
+        return hypStack.push(hyp)
 
     # score
     #
     # args:     hyp         the hypothesis to score
-    #           prev_cost   the cost of the previous stage (backpointer) of the search
+    #           prev_cost   the present cost of the previous stage (backpointer) of the search
+    #           [future]    (OPTIONAL) the future cost of the hypothesis, if already known
     #
-    # returns:  the score of the given hypothesis    
+    # returns:  (present cost, score) of the given hypothesis, where the score adds the future
+    #           cost to the present cost; only the present cost carries over to expansions
+
+    def score (self, hyp, prev_cost, future=None):
 
-    def score (self, hyp, prev_cost):
+        if future is None:
+            future = self.future_cost(hyp.coverage)
 
-        return self.present_cost(hyp, prev_cost) + self.future_cost(hyp)
+        cost = self.present_cost(hyp, prev_cost)
+        return (cost, cost + future)
 
     # present_cost
     #
     # args:     hyp                 the hypothesis to score
     #           prev_cost           the cost of the previous stage (backpointer) of the search
     #
-    # returns:  the present cost of the given hypothesis
+    # returns:  the present cost of the given hypothesis; also sets the hypothesis's lm_state
 
     def present_cost (self, hyp, prev_cost):
 
-        # cand  =   [0] new translated phrase
-        #           [1] [0] original foreign word
-        #               [1] translated index (index of orig. word in foreign sentence)
-        #           [2] [0] marked words (list of booleans)
-        #               [1] number of marked words
-        #           [3] score
-        #           [4] backpointer
-
-        translated = hyp[0]
-        foreign    = hyp[1][0]
-        (prev_stack, stack_loc) = hyp[4]
-        prev_word  = self.hyp_stacks[prev_stack][stack_loc][0]
+        prev_words = hyp.back.option.english
 
         # present_cost formula from Jurafsky, p. 36 of "Machine Translation" chapter
-        translation_p = self.translations[foreign][translated]
+        translation_p = hyp.option.score
 
-        # only take distortion and transition into account when there is valid previous word
-        if prev_word is not None:
+        (transition_p, hyp.lm_state) = self.transition_prob(hyp.back.lm_state, hyp.option)
+
+        # only take distortion into account when there is valid previous phrase
+        if prev_words is not None:
         
             distortion_p  = self.distortion(hyp)
-            transition_p  = self.transition_prob(self.get_last_word(prev_word), 
-                                                 self.get_first_word(translated))
 
             return prev_cost + translation_p + log(distortion_p) + transition_p
 
         else:
 
-            return translation_p
-
-    def get_first_word (self, phrase):
-        return phrase.split(' ', 1)[0]
-
-    def get_last_word (self, phrase):
-        return phrase.split(' ', 1)[-1]
+            return translation_p + transition_p
 
     # distortion
     # 
@@ -403,155 +1338,107 @@ class BeamSearch:
 
     def distortion (self, hyp, alpha=0.5):
 
-        (curr_start, _) = hyp[1][1]
+        (curr_start, _) = hyp.option.span
         
-        (prev_stack, stack_loc) = hyp[4]
-        prev_hyp        = self.hyp_stacks[prev_stack][stack_loc]
-        (_, prev_end)   = prev_hyp[1][1]
+        (_, prev_end)   = hyp.back.option.span
         return pow(alpha, abs(curr_start - prev_end - 1))
 
-    # future_cost
+    # future_cost_table
     #
-    # args:     hyp         the hypothesis to score
+    # args:     none (uses the source-sentence-dependent class elements)
     #
-    # returns:  the future cost of the given hypothesis
-
-    def future_cost (self, hyp):
-
-        # gather still-to-be-translated words from the hypothesis
-        # TODO : place for improvement (consider phrases)
-        unmarked = []
-        for (i, marked) in enumerate(hyp[2][0], start=0):
-            if marked is False:
-                unmarked.append(self.source_sent[i])
-
-        # if all marked, no future cost
-        if not unmarked:
-            return 0.0
-
-        # if there were no transitions between two words in the sentence
-        # seen in our training set, return negative infinity as the probability
-        try:
-            v_probs = self.populate_viterbi_probs(unmarked)
-        except UnknownTransitionError:
-            return float("-inf")
-
-        # else return the best log probability
-        return self.best_viterbi_prob(v_probs)
-
-    # populate_viterbi_probs
-    # 
-    # args:    sent     a given list of words to calculate the Viterbi probability table for
-    # 
-    # returns: the populated dynamic programming table of Viterbi (log) probabilities
-
-    def populate_viterbi_probs(self, sent):
-
-        v_probs = []
+    # returns:  a table where table[start][end] is the best estimated (log) score of translating
+    #           source words start..end-1: the best translation + LM estimate of any phrase 
+    #           covering exactly that span, or of any split of the span into smaller spans
+    #
+    # notes:    computed once per sentence; words that no phrase covers can never be translated
+    #           (every hypothesis leaves them uncovered), so they cost nothing
 
-        for (i, word) in enumerate(sent, start=0):
+    def future_cost_table (self):
 
-            v_probs.append({})
-            
-            # initialize the first cell in the Viterbi probability table (base case in dynamic 
-            # programming algorithm)
-            if i == 0:
+        n     = self.num_words
+        table = [[float("-inf")] * (n + 1) for _ in range(n + 1)]
+        covered_by_phrase = [False] * n
 
-                for trans in self.translations[sent[i]]:
-                    v_probs[i][trans] = self.translations[sent[i]][trans]
+        for start in range(n):
+            for (end, options) in self.lattice[start]:
 
-            # otherwise, populate the probability table with the highest probabilities of seeing 
-            # the given translation at the current word, based on the previous possible 
-            # translations
-            else:
+                table[start][end] = max(option.estimate for option in options)
 
-                for trans in self.translations[sent[i]]:
+                for i in range(start, end):
+                    covered_by_phrase[i] = True
 
-                    trans_prob = self.translations[sent[i]][trans]
-                    best_prob  = None
+        for i in range(n):
+            if not covered_by_phrase[i]:
+                table[i][i + 1] = 0.0
 
-                    for prev_trans in v_probs[i - 1]:
-                        curr_prob = trans_prob * self.transition_prob(prev_trans, trans)
+        # combine the estimates of adjacent spans, shortest spans first
+        for length in range(2, n + 1):
+            for start in range(0, n - length + 1):
 
-                        if best_prob is None or curr_prob > best_prob:
-                            best_prob = curr_prob
+                end  = start + length
+                best = table[start][end]
 
-                    if best_prob is not None:
-                        v_probs[i][trans] = best_prob
+                for split in range(start + 1, end):
+                    estimate = table[start][split] + table[split][end]
+                    if estimate > best:
+                        best = estimate
 
-                if len(v_probs[i]) is 0:
-                    raise UnknownTransitionError
+                table[start][end] = best
 
-        return v_probs
+        return table
 
-    # best_viterbi_prob
+    # phrase_lm
     #
-    # args:    vprobs   a table of Viterbi probabilities (generated via PopulateViterbiProbs)
+    # args:     phrase      an English phrase (a tuple of word ids)
     #
-    # returns: the minimum Viterbi probability in the (last column of the) given table of Viterbi 
-    #          probabilities
-
-    def best_viterbi_prob(self, v_probs):
-
-        num_cols = len(v_probs)
-        best = float("-inf")
+    # returns:  (the (log) language model estimate of the phrase on its own, the phrase-internal
+    #           score, the LM state after the phrase or None), where the phrase-internal score
+    #           covers the words after the first order - 1 (whose whole LM context is inside the
+    #           phrase), and the state only depends on the phrase if it has order - 1 words
+    #
+    # notes:    none of these depend on the sentence being translated, so they are computed
+    #           once per English phrase and cached for the lifetime of the decoder
 
-        for term in v_probs[num_cols - 1]:
-            prob = v_probs[num_cols - 1][term]
-            if prob > best:
-                best = prob
+    def phrase_lm (self, phrase):
 
-        return best
+        scores = self.phrase_lm_cache.get(phrase)
 
-    # prune_stack
-    #
-    # args:     hypStack    the hypothesis stack to prune
-    #           prune       the pruning method (THRESHOLD or HISTOGRAM)
-    #           pthresh     the pruning threshold
-    #
-    # returns:  a pruned version of the supplies hypStack, pruned using the given methods / threshold
+        if scores is None:
 
-    def prune_stack (self, hypStack, prune, pthresh):
+            head = self.transitions.order - 1
 
-        minScore = self.min_score(hypStack, prune, pthresh)
+            (estimate, _)      = self.transitions.ScorePhrase(phrase)
+            (_, head_state)    = self.transitions.ScorePhrase(phrase[:head])
+            (lm_score, state)  = self.transitions.ScorePhrase(phrase[head:], head_state)
 
-        # while the lowest entry in the hypStack is less than the minScore, continue dropping
-        # entries from the stack
-        while len(hypStack) > 0 and hypStack[0][3] < minScore:
-            hypStack.pop(0)
+            scores = (estimate, lm_score, state if len(phrase) >= head else None)
+            self.phrase_lm_cache[phrase] = scores
 
-        return hypStack
+        return scores
 
-    # calc_thresh
+    # future_cost
     #
-    # args:     hypStack    the hypothesis stack on which to calculate the min score
-    #           prune       the pruning method (THRESHOLD or HISTOGRAM)
-    #           pthresh     the pruning threshold
+    # args:     covered     the translated set of words (bitmask) of a hypothesis
     #
-    # returns:  the min score required to retain an entry in the given hypStack
-
-    def min_score (self, hypStack, prune, pthresh):
+    # returns:  the future cost of the hypothesis: the sum of the future cost table entries of
+    #           its uncovered contiguous spans
 
-        if prune is Prune.THRESHOLD:
+    def future_cost (self, covered):
 
-            if len(hypStack) is 0:
-                return float("-inf")
+        uncovered = ~covered & self.full_mask
+        cost      = 0.0
 
-            # pthresh is the alpha value
-            else:
-                return pthresh * hypStack[-1][1]
+        while uncovered:
 
-        elif prune is Prune.HISTOGRAM:
+            start  = (uncovered & -uncovered).bit_length() - 1
+            run    = uncovered >> start
+            length = (~run & (run + 1)).bit_length() - 1
 
-            if len(hypStack) < pthresh:
-                return float("-inf")
-
-            # pthresh is the number of values to keep in the hypStack at once
-            else:
-                return hypStack[-pthresh][1]
+            cost      += self.future_costs[start][start + length]
+            uncovered ^= ((1 << length) - 1) << start
 
-        else:
-            raise ValueError("Invalid pruning metric supplied.")
+        return cost
 
     # best_cand
     #
@@ -561,13 +1448,7 @@ class BeamSearch:
 
     def best_cand (self, hyp_stack):
 
-        best = None
-
-        for cand in hyp_stack:
-            if best is None or cand[3] > best[3]:
-                best = cand
-
-        return best
+        return hyp_stack.best()
 
     # backtrace
     #
@@ -580,19 +1461,16 @@ class BeamSearch:
         if cand is None:
             return "No translation found."
 
-        curr_word  = cand[0]
-
         # base case: at the beginning of the sentence (no more to backtrace)
-        if cand[4] is None:
+        if cand.back is None:
             return ""
 
         # recursive case: append the current word onto the end of the remainder of the sentence
         # to backtrace
         else:
 
-            (prev_stack, index) = cand[4]
-            prev_cand  = self.hyp_stacks[prev_stack][index]
-            prev_words = self.backtrace(prev_cand)
+            curr_word  = " ".join(self.vocab.decode(cand.option.english))
+            prev_words = self.backtrace(cand.back)
 
             # space-handling; don't prepend a space to the beginning of a sentence
             if prev_words == "":
@@ -10,13 +10,42 @@
 #                                                                                                #
 ##################################################################################################
 
+import os
 import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from itertools import groupby
 from collections import defaultdict
 from math import log, exp
+from vocab import Vocabulary
+from utilities import write_array, map_array
+from quantize import quantize, QuantizedArray
+
+# UnknownBigramError
+#
+# raised by LogProb_NoSmooth for a bigram that was never seen in training (which has no
+# unsmoothed probability)
+
+class UnknownBigramError(KeyError):
+    pass
+
+# BigramLM
+#
+# words are interned in the model's vocabulary when the training corpus is loaded; every table
+# below is keyed by word ids, and the LogProb_* functions take word ids
 
 class BigramLM:
 
-    def __init__(self):
+    # init
+    #
+    # args:     [vocab]     (OPTIONAL) the Vocabulary to intern words in, e.g. to share ids with
+    #                       a translation table; a new one is created by default
+
+    def __init__(self, vocab=None):
+
+        self.vocab = vocab if vocab is not None else Vocabulary()
 
         # unigram_counts[unigram] = count
         self.unigram_counts = defaultdict(float)
@@ -42,6 +71,17 @@ class BigramLM:
         self.LoadNGrams(train_corpus)
         self.CalcLogProbs()
 
+    # freeze
+    #
+    # args:     none
+    #
+    # returns:  a FrozenBigramLM holding this model's counts, for read-only scoring once
+    #           training is done
+
+    def freeze(self):
+
+        return FrozenBigramLM(self)
+
     # LoadNGrams
     #
     # args:     train_corpus    the training corpus to model
@@ -53,21 +93,21 @@ class BigramLM:
 
         for sentence in train_corpus:
 
-            prev_word = ''
-            for word in sentence:
+            prev_word = None
+            for word in self.vocab.encode(sentence, add=True):
 
                 # load the unigram
                 self.AddUnigram(word)
 
                 # load the bigram
-                if prev_word is not '':
+                if prev_word is not None:
                     self.AddBigram(prev_word, word)
                     
                 prev_word = word
 
     # AddUnigram
     #
-    # args:     word        a unigram
+    # args:     word        a unigram (word id)
     #
     # returns:  none; adds a unigram and increments its count within the model's unigram count
     #           table (if a unigram has not been seen before, its count is 1)
@@ -86,7 +126,8 @@ class BigramLM:
         
     # AddBigram
     #
-    # args:     word        a bigram
+    # args:     word1       the first word (id) of a bigram
+    #           word2       the second word (id) of the bigram
     #
     # returns:  none; adds a bigram and increments its count within the model's bigram count
     #           table (if a bigram has not been seen before, its count is 1)
@@ -127,27 +168,32 @@ class BigramLM:
                 p_bigram = successor_freq / curr_total_successors
                 self.log_probs[unigram][successor] = log(p_bigram)
 
-    # CalcLogProbs
+    # CheckDistribution
     #
     # args:     none
     #
     # returns:  checks the distribution of the log probability table, ensuring that the 
-    #           total probability of each bigram, given the first word, is 1
+    #           total probability of each bigram, given the first word, is 1 (words that are
+    #           never followed by another, such as the last word of the corpus, are skipped)
+    #
+    # notes:    see lm_eval.check_normalization for a vectorized check of a frozen model
 
     def CheckDistribution(self):
 
         for unigram in self.unigram_counts:
 
-            if unigram is end_token:
+            successors = self.log_probs.get(unigram)
+
+            if not successors:
                 continue
 
-            total_prob = sum(exp(x) for x in self.log_probs[unigram].values())
-            assert numpy.isclose(total_prob, 1)
+            total_prob = sum(exp(x) for x in successors.values())
+            assert abs(total_prob - 1) < 1e-9
 
     # LogProb_NoSmooth
     #
-    # args:     prev_word           the first word in the word pair
-    #           word                the second word in the word pair
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
     # 
     # returns:  given a bigram (composed of prev_word and word), returns the log probability of 
     #           that bigram - without any smoothing
@@ -161,8 +207,8 @@ class BigramLM:
 
     # LogProb_Laplace
     #
-    # args:     prev_word           the first word in the word pair
-    #           word                the second word in the word pair
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
     # 
     # returns:  given a bigram (composed of prev_word and word), returns the log probability of 
     #           that bigram - with Laplace smoothing
@@ -184,8 +230,8 @@ class BigramLM:
 
     # LogProb_SimpleInterp
     #
-    # args:     prev_word           the first word in the word pair
-    #           word                the second word in the word pair
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
     #           w_unigram           the unigram weight to utilize in the simple linear 
     #                               interpolation calculation
     #           w_bigram            similar to w_unigram, but for bigram weight
@@ -220,15 +266,17 @@ class BigramLM:
             
     # ApplyDeletedInterp
     #
-    # args:     held_out_corpus         a held out dataset (distinct from train and test sets)
+    # args:     [held_out_corpus]       (OPTIONAL) unused: deleted interpolation estimates the
+    #                                   weights from the training counts themselves, deleting
+    #                                   each bigram in turn
     # 
     # returns:  returns the best unigram and bigram weights to utilize (in simple linear
-    #           interpolation), based on the language model constructed of the held out corpus
+    #           interpolation), based on the counts of the training corpus
     #
     # notes:    algorithm based on outlined available in Speech and Language Processing by
-    #           Daniel Jurafsky
+    #           Daniel Jurafsky; see lm_eval.deleted_interpolation for a vectorized version
 
-    def ApplyDeletedInterp(self, held_out_corpus):
+    def ApplyDeletedInterp(self, held_out_corpus=None):
 
         w_unigram = 0.0
         w_bigram = 0.0
@@ -260,4 +308,468 @@ class BigramLM:
 
         w_total = w_unigram + w_bigram
 
-        return (w_unigram / w_total), (w_bigram / w_total)
\ No newline at end of file
+        return (w_unigram / w_total), (w_bigram / w_total)
+
+# FrozenBigramLM
+#
+# a read-only, compiled copy of a trained BigramLM. The bigram counts are stored in compressed
+# sparse row (CSR) form: the successors of the word with id w are successors[offsets[w]:
+# offsets[w + 1]], sorted by id, with their counts and log probabilities at the same positions
+# of the parallel arrays. Per-context totals and smoothing normalizers are computed once here,
+# so a lookup is a binary search within one row, and (unlike the defaultdicts of BigramLM)
+# querying an unseen word never adds anything to the model.
+#
+# A frozen model can be saved to a binary file (Save) and memory-mapped back in (Load): loading
+# only reads the header and the vocabulary, and the arrays are read from the mapped file on
+# access, so every process that loads the same file shares its pages.
+
+class FrozenBigramLM:
+
+    # the binary file format: a header (magic string, format version, sizes and totals), the 
+    # vocabulary (newline-separated, in id order), then the arrays in the order of ARRAYS, each 
+    # padded to 8 bytes
+    MAGIC   = "BIGRAMLM"
+    VERSION = 1
+    HEADER  = struct.Struct("<8sIqqqqqqqd")
+
+    # (name, typecode, length) of the arrays, where length is the number of contexts plus the
+    # given number of extra values, or None for the number of bigrams
+    ARRAYS  = [('unigram_counts', 'i', 0), ('offsets', 'i', 1), ('totals', 'd', 0),
+               ('laplace_unseen', 'd', 0), ('successors', 'i', None), ('counts', 'i', None),
+               ('log_probs', 'd', None), ('laplace_log_probs', 'd', None)]
+
+    # init
+    #
+    # args:     [model]     (OPTIONAL) a trained BigramLM to compile; if not given, the model is
+    #                       empty until it is loaded (see Load)
+
+    def __init__(self, model=None):
+
+        if model is not None:
+            self.Compile(model)
+
+    # Compile
+    #
+    # args:     model       a trained BigramLM
+    #
+    # returns:  none; fills the arrays of this model from the counts of the given model
+
+    def Compile(self, model):
+
+        rows = ((prev_word, sorted(model.bigram_counts.get(prev_word, {}).items()))
+                for prev_word in range(len(model.vocab)))
+
+        self.CompileRows(model.vocab, model.unigram_counts, rows)
+
+    # CompileCounts
+    #
+    # args:     unigram_counts  dict, unigram_counts[word] = count (words as strings)
+    #           bigram_counts   an iterable over ((first_word, second_word), count) pairs 
+    #                           (words as strings), sorted by bigram
+    #
+    # returns:  none; fills the arrays of this model from the given counts, interning the words
+    #           in a new Vocabulary in sorted order
+    #
+    # notes:    since ids follow the sort order of the words, bigram_counts arrives grouped by
+    #           context and sorted by successor id, and is consumed in a single pass (e.g.
+    #           straight from the merged spill files of count_bigrams)
+
+    def CompileCounts(self, unigram_counts, bigram_counts):
+
+        vocab = Vocabulary()
+        for word in sorted(unigram_counts):
+            vocab.add(word)
+
+        unigram_ids = dict((vocab.get(word), count) for (word, count) in unigram_counts.items())
+
+        rows = ((vocab.get(first_word), [(vocab.get(bigram[1]), count)
+                                         for (bigram, count) in row])
+                for (first_word, row) in groupby(bigram_counts, key=lambda entry: entry[0][0]))
+
+        self.CompileRows(vocab, unigram_ids, rows)
+
+    # CompileRows
+    #
+    # args:     vocab           the Vocabulary the counts are keyed by
+    #           unigram_counts  dict, unigram_counts[word] = count (word ids)
+    #           rows            an iterable over (prev_word, successors) pairs, in increasing
+    #                           order of prev_word, where successors is the list of (word,
+    #                           count) pairs of prev_word, in increasing order of word; words 
+    #                           with no successors may be left out
+    #
+    # returns:  none; fills the arrays of this model, computing the totals and smoothing
+    #           normalizers of every context
+
+    def CompileRows(self, vocab, unigram_counts, rows):
+
+        self.order = 2
+        self.vocab = vocab
+
+        self.total_unigrams = int(sum(unigram_counts.values()))
+        self.total_uq_unigrams = sum(1 for count in unigram_counts.values() if count > 0)
+        self.total_bigrams = 0
+        self.total_uq_bigrams = 0
+
+        # contexts are the ids 0 .. num_contexts - 1 (every word interned so far); words interned
+        # after freezing have no counts
+        num_contexts = len(self.vocab)
+        self.num_contexts = num_contexts
+
+        # the Laplace smoothing constant
+        V = self.total_uq_unigrams - 1
+
+        # unigram_counts[word] = count
+        self.unigram_counts = array('i', [0]) * num_contexts
+        for word in unigram_counts:
+            self.unigram_counts[word] = int(unigram_counts[word])
+
+        self.offsets = array('i', [0]) * (num_contexts + 1)
+        self.successors = array('i')
+        self.counts = array('i')
+
+        # log_probs[i]: log probability of the i-th bigram without smoothing
+        # laplace_log_probs[i]: log probability of the i-th bigram with Laplace smoothing
+        self.log_probs = array('d')
+        self.laplace_log_probs = array('d')
+
+        # totals[w]: total count of the successors of w
+        # laplace_unseen[w]: Laplace-smoothed log probability of any unseen successor of w
+        self.totals = array('d', [0.0]) * num_contexts
+        self.laplace_unseen = array('d', [log(1.0 / V)]) * num_contexts
+
+        for (prev_word, successors) in rows:
+
+            N = float(sum(count for (_, count) in successors))
+
+            for (word, count) in successors:
+
+                self.successors.append(word)
+                self.counts.append(int(count))
+                self.log_probs.append(log(count / N))
+                self.laplace_log_probs.append(log((count + 1.0) / (N + V)))
+
+            self.offsets[prev_word + 1] = len(self.successors)
+            self.totals[prev_word] = N
+            self.laplace_unseen[prev_word] = log(1.0 / (N + V))
+
+            self.total_bigrams = self.total_bigrams + int(N)
+            self.total_uq_bigrams = self.total_uq_bigrams + len(successors)
+
+        # words left out of rows have no successors: their range ends where the previous one does
+        for word in range(num_contexts):
+            if self.offsets[word + 1] < self.offsets[word]:
+                self.offsets[word + 1] = self.offsets[word]
+
+        # the Laplace-smoothed log probability of any word after a context with no counts
+        self.laplace_empty = log(1.0 / V)
+        self.unknown_log_prob = self.laplace_empty
+
+    # Save
+    #
+    # args:     file_name   the file to save the model to
+    #
+    # returns:  none; writes the model in the binary format read by Load
+    #
+    # notes:    the file is written under a temporary name and then renamed, so a process that
+    #           loads it never sees a partial file
+
+    def Save(self, file_name):
+
+        words = "\n".join(self.vocab.decode(range(self.num_contexts)))
+
+        tmp_name = "%s.%d.tmp" % (file_name, os.getpid())
+        with open(tmp_name, 'wb') as f:
+
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.num_contexts,
+                                     len(self.successors), len(words), self.total_unigrams,
+                                     self.total_uq_unigrams, self.total_bigrams,
+                                     self.total_uq_bigrams, self.laplace_empty))
+
+            f.write(words)
+            f.write("\0" * (-len(words) % 8))
+
+            for (name, _, _) in self.ARRAYS:
+                write_array(f, getattr(self, name))
+
+        os.rename(tmp_name, file_name)
+
+    # Load
+    #
+    # args:     file_name   a file written by Save
+    #
+    # returns:  none; memory-maps the file and replaces this model's vocabulary and arrays with 
+    #           the saved ones (the arrays stay in the file, and are read on access)
+
+    def Load(self, file_name):
+
+        with open(file_name, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, num_contexts, num_bigrams, words_len, self.total_unigrams,
+         self.total_uq_unigrams, self.total_bigrams, self.total_uq_bigrams,
+         self.laplace_empty) = self.HEADER.unpack_from(buf, 0)
+
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("%s is not a bigram language model file." % file_name)
+
+        self.unknown_log_prob = self.laplace_empty
+
+        self.order = 2
+        offset = self.HEADER.size
+
+        self.vocab = Vocabulary()
+        if words_len:
+            for word in buf[offset:offset + words_len].split("\n"):
+                self.vocab.add(word)
+
+        offset = offset + words_len + (-words_len % 8)
+
+        self.num_contexts = num_contexts
+        for (name, typecode, extra) in self.ARRAYS:
+
+            length = num_bigrams if extra is None else num_contexts + extra
+            (values, offset) = map_array(buf, offset, typecode, length)
+            setattr(self, name, values)
+
+        self.buffer = buf
+
+    # Quantize
+    #
+    # args:     [bits]      (OPTIONAL) the number of bits per log probability (1 to 16)
+    #
+    # returns:  the largest absolute error the quantization introduced into a log probability;
+    #           replaces the per-bigram log probabilities (with and without smoothing) with
+    #           QuantizedArrays, each with its own codebook, cutting them from 8 bytes per
+    #           bigram to 1 (or 2)
+    #
+    # notes:    the per-context totals and normalizers are kept exact; a quantized model is
+    #           saved with its representative values, as doubles. Only the arrays are replaced
+    #           (never modified), so quantizing a copy.copy of a model leaves the model itself
+    #           untouched; a model can only be quantized once
+
+    def Quantize(self, bits=8):
+
+        if isinstance(self.log_probs, QuantizedArray):
+            raise ValueError("The model is already quantized.")
+
+        log_probs = quantize(self.log_probs, bits)
+        laplace_log_probs = quantize(self.laplace_log_probs, bits)
+
+        error = max(log_probs.codebook.max_error(self.log_probs),
+                    laplace_log_probs.codebook.max_error(self.laplace_log_probs))
+
+        self.log_probs = log_probs
+        self.laplace_log_probs = laplace_log_probs
+
+        return error
+
+    # find
+    #
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
+    #
+    # returns:  the position of the bigram in the CSR arrays, or -1 if it was never seen
+
+    def find(self, prev_word, word):
+
+        if prev_word is None or not 0 <= prev_word < self.num_contexts:
+            return -1
+
+        lo = self.offsets[prev_word]
+        hi = self.offsets[prev_word + 1]
+        i = bisect_left(self.successors, word, lo, hi)
+
+        if i < hi and self.successors[i] == word:
+            return i
+        else:
+            return -1
+
+    # BigramCount
+    #
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
+    #
+    # returns:  the number of times the bigram was seen in training
+
+    def BigramCount(self, prev_word, word):
+
+        i = self.find(prev_word, word)
+        return self.counts[i] if i >= 0 else 0
+
+    # LogProb_NoSmooth
+    #
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
+    # 
+    # returns:  given a bigram (composed of prev_word and word), returns the log probability of 
+    #           that bigram - without any smoothing
+
+    def LogProb_NoSmooth(self, prev_word, word):
+
+        i = self.find(prev_word, word)
+
+        if i >= 0:
+            return self.log_probs[i]
+        else:
+            raise UnknownBigramError
+
+    # LogProb_Laplace
+    #
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
+    # 
+    # returns:  given a bigram (composed of prev_word and word), returns the log probability of 
+    #           that bigram - with Laplace smoothing
+
+    def LogProb_Laplace(self, prev_word, word):
+
+        i = self.find(prev_word, word)
+
+        if i >= 0:
+            return self.laplace_log_probs[i]
+        elif prev_word is not None and 0 <= prev_word < self.num_contexts:
+            return self.laplace_unseen[prev_word]
+        else:
+            return self.laplace_empty
+
+    # LogProbs_Laplace
+    #
+    # args:     pairs               an iterable of (prev_word, word) pairs of word ids
+    # 
+    # returns:  the list of the Laplace-smoothed log probabilities of the bigrams, in order
+    #
+    # notes:    the pairs are looked up grouped by prev_word, so each CSR row is located once
+    #           per batch rather than once per pair
+
+    def LogProbs_Laplace(self, pairs):
+
+        pairs = list(pairs)
+        result = [self.laplace_empty] * len(pairs)
+
+        by_context = defaultdict(list)
+        for (n, (prev_word, word)) in enumerate(pairs):
+            if prev_word is not None and 0 <= prev_word < self.num_contexts:
+                by_context[prev_word].append((word, n))
+
+        successors = self.successors
+        for prev_word in by_context:
+
+            lo = self.offsets[prev_word]
+            hi = self.offsets[prev_word + 1]
+            unseen = self.laplace_unseen[prev_word]
+
+            for (word, n) in by_context[prev_word]:
+
+                i = bisect_left(successors, word, lo, hi)
+
+                if i < hi and successors[i] == word:
+                    result[n] = self.laplace_log_probs[i]
+                else:
+                    result[n] = unseen
+
+        return result
+
+    # NumNGrams
+    #
+    # args:     k           an order of the model (1 or 2)
+    #
+    # returns:  the number of k-grams in the model
+
+    def NumNGrams(self, k):
+
+        return self.num_contexts if k == 1 else len(self.successors)
+
+    # NGrams
+    #
+    # args:     k           an order of the model (1 or 2)
+    #
+    # returns:  a generator over the (k-gram, log probability, log backoff weight) of every 
+    #           k-gram, with the Laplace-smoothed model written in backoff form: every unigram
+    #           has probability 1 / V (the probability after a context with no counts), and
+    #           the backoff weight of a context makes 1 / V up to its own unseen probability
+
+    def NGrams(self, k):
+
+        if k == 1:
+            for word in range(self.num_contexts):
+                yield ((word,), self.laplace_empty,
+                       self.laplace_unseen[word] - self.laplace_empty)
+            return
+
+        for prev_word in range(self.num_contexts):
+            for i in range(self.offsets[prev_word], self.offsets[prev_word + 1]):
+                yield ((prev_word, self.successors[i]), self.laplace_log_probs[i], 0.0)
+
+    # BeginState
+    #
+    # args:     none
+    #
+    # returns:  the LM state at the start of a sentence; a bigram state is just the previous
+    #           word (id), and there is none yet
+
+    def BeginState(self):
+
+        return None
+
+    # Score
+    #
+    # args:     state       an LM state (the previous word id, or None for no context)
+    #           word        the next word (id)
+    #
+    # returns:  (Laplace-smoothed log probability of word in state, the LM state after word);
+    #           a word with no previous word is not scored
+
+    def Score(self, state, word):
+
+        if state is None:
+            return (0.0, word)
+
+        return (self.LogProb_Laplace(state, word), word)
+
+    # ScorePhrase
+    #
+    # args:     words       a sequence of word ids
+    #           [state]     (OPTIONAL) the LM state before the phrase; by default the phrase is
+    #                       scored with no context
+    #
+    # returns:  (total log probability of the words, the LM state after them)
+
+    def ScorePhrase(self, words, state=None):
+
+        total = 0.0
+        for word in words:
+            (log_prob, state) = self.Score(state, word)
+            total = total + log_prob
+
+        return (total, state)
+
+    # LogProb_SimpleInterp
+    #
+    # args:     prev_word           the first word (id) in the word pair
+    #           word                the second word (id) in the word pair
+    #           w_unigram           the unigram weight to utilize in the simple linear 
+    #                               interpolation calculation
+    #           w_bigram            similar to w_unigram, but for bigram weight
+    # 
+    # returns:  given a bigram (composed of prev_word and word), returns the log probability of 
+    #           that bigram - using simple linear interpolation to calculate the base probability
+
+    def LogProb_SimpleInterp(self, prev_word, word, w_unigram, w_bigram):
+
+        i = self.find(prev_word, word)
+
+        if i >= 0:
+            p_bigram = self.counts[i] / self.totals[prev_word]
+        else:
+            p_bigram = 0
+
+        if word is not None and 0 <= word < self.num_contexts:
+            p_unigram = float(self.unigram_counts[word]) / self.total_unigrams
+        else:
+            p_unigram = 0
+
+        prob = w_unigram * p_unigram + w_bigram * p_bigram
+        if prob > 0:
+            return log(prob)
+        else:
+            return float("-inf")
@@ -0,0 +1,329 @@
+# Sharded N-gram Counting (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                     SHARDED N-GRAM COUNTING                                    #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+Counts the n-grams of a training corpus too large to hold in memory, for building a
+FrozenBigramLM or a KneserNeyLM without going through their in-memory counting (LoadNGrams):
+
+    - the corpus is read as a stream (e.g. from tokenize_stream) and cut into shards of
+      sentences, which worker processes count in parallel
+    - the shard counts are merged in the parent process; whenever the merged n-gram counts grow
+      past a budget, they are written out, sorted, to a spill file and cleared
+    - at the end, the spill files are merged (heapq.merge), summing the counts of equal n-grams,
+      into one sorted stream of n-gram counts that the models compile in a single pass
+
+Only the unigram counts (one per word of the vocabulary) are kept in memory throughout. For a
+Kneser-Ney model, the continuation counts of each lower order are summed the same way, from the
+stream of the order above, and each order of the trie is compiled from its own sorted file.
+
+"""
+
+import os
+import sys
+import heapq
+import shutil
+import tempfile
+from functools import partial
+from itertools import groupby
+from multiprocessing import Pool, cpu_count
+from collections import defaultdict
+from bigram import FrozenBigramLM
+from kneser_ney import KneserNeyLM
+from vocab import Vocabulary
+from utilities import tokenize_stream, map_shards
+
+# count_shard
+#
+# args:     sentences       a list of tokenized sentences
+#           [order]         (OPTIONAL) the number of words in the n-grams to count
+#           [boundaries]    (OPTIONAL) if True, each sentence is counted between "<s>" and
+#                           "</s>", and the k-grams (k < order) that start it are counted too,
+#                           as by KneserNeyLM.LoadNGrams
+#
+# returns:  (unigram counts, n-gram counts) of the sentences, as dicts keyed by word and by
+#           tuple of words
+
+def count_shard(sentences, order=2, boundaries=False):
+
+    unigrams = defaultdict(int)
+    ngrams   = defaultdict(int)
+
+    for sentence in sentences:
+
+        for word in sentence:
+            unigrams[word] += 1
+
+        tokens = ["<s>"] + sentence + ["</s>"] if boundaries else sentence
+
+        for i in range(1, len(tokens)):
+
+            if i >= order - 1:
+                ngrams[tuple(tokens[i - order + 1:i + 1])] += 1
+            elif boundaries:
+                ngrams[tuple(tokens[:i + 1])] += 1
+
+    return (dict(unigrams), dict(ngrams))
+
+# write_counts
+#
+# args:     entries         an iterable over (n-gram, count) pairs, sorted by n-gram
+#           spill_dir       the directory to write the file in
+#
+# returns:  the name of a new file holding the counts, one "word ... word<tab>count" line per
+#           n-gram, in order
+
+def write_counts(entries, spill_dir):
+
+    (fd, file_name) = tempfile.mkstemp(suffix=".counts", dir=spill_dir)
+
+    with os.fdopen(fd, 'w') as f:
+        for (ngram, count) in entries:
+            f.write("%s\t%d\n" % (" ".join(ngram), count))
+
+    return file_name
+
+# spill
+#
+# args:     ngrams          dict, ngrams[(word, ..., word)] = count
+#           spill_dir       the directory to write the spill file in
+#
+# returns:  the name of a new file holding the counts, sorted by n-gram (see write_counts)
+
+def spill(ngrams, spill_dir):
+
+    return write_counts(sorted(ngrams.items()), spill_dir)
+
+# read_spill
+#
+# args:     file_name       a file written by write_counts
+#
+# returns:  a generator over the (n-gram, count) pairs in the file, in order
+
+def read_spill(file_name):
+
+    with open(file_name, 'r') as f:
+        for line in f:
+            (ngram, count) = line.rstrip("\n").split("\t")
+            yield (tuple(ngram.split(" ")), int(count))
+
+# merge_counts
+#
+# args:     streams         iterables over (n-gram, count) pairs, each sorted by n-gram
+#
+# returns:  a generator over the (n-gram, total count) of every n-gram in the streams, sorted
+#           by n-gram
+
+def merge_counts(streams):
+
+    for (ngram, entries) in groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+        yield (ngram, sum(count for (_, count) in entries))
+
+# sum_counts
+#
+# args:     entries         an iterable over (n-gram, count) pairs, in any order
+#           spill_dir       the directory to write the spill files in
+#           [max_ngrams]    (OPTIONAL) the number of distinct n-grams held in memory before
+#                           they are spilled to disk
+#
+# returns:  a generator over the (n-gram, total count) of every n-gram in entries, sorted by
+#           n-gram; entries are consumed before this returns, and the spill files are left in
+#           spill_dir for the caller to remove
+
+def sum_counts(entries, spill_dir, max_ngrams=5000000):
+
+    counts = defaultdict(int)
+    spills = []
+
+    for (ngram, count) in entries:
+
+        counts[ngram] += count
+
+        if len(counts) > max_ngrams:
+            spills.append(spill(counts, spill_dir))
+            counts = defaultdict(int)
+
+    streams = [read_spill(file_name) for file_name in spills]
+    streams.append(sorted(counts.items()))
+
+    return merge_counts(streams)
+
+# count_ngrams
+#
+# args:     sentences       an iterable over tokenized sentences (e.g. tokenize_stream)
+#           [order]         (OPTIONAL) the number of words in the n-grams to count
+#           [boundaries]    (OPTIONAL) if True, count with sentence boundaries (see count_shard)
+#           [processes]     (OPTIONAL) the number of worker processes (defaults to the number
+#                           of CPUs)
+#           [shard_size]    (OPTIONAL) the number of sentences counted by a worker at a time
+#           [max_ngrams]    (OPTIONAL) the number of distinct n-grams held in memory before
+#                           they are spilled to disk
+#           [spill_dir]     (OPTIONAL) the directory to create the spill files under (defaults
+#                           to the system's temporary directory)
+#
+# returns:  (unigram counts, n-gram counts), where the unigram counts are a dict keyed by word
+#           and the n-gram counts a generator over (n-gram, count) pairs, sorted by n-gram; the
+#           spill files are removed once the generator is exhausted (or closed)
+
+def count_ngrams(sentences, order=2, boundaries=False, processes=None, shard_size=10000,
+                 max_ngrams=5000000, spill_dir=None):
+
+    processes = processes or cpu_count()
+    spill_dir = tempfile.mkdtemp(prefix="ngram_counts", dir=spill_dir)
+
+    unigrams = defaultdict(int)
+
+    counter = partial(count_shard, order=order, boundaries=boundaries)
+
+    pool = Pool(processes)
+
+    def shard_counts():
+
+        for (shard_unigrams, shard_ngrams) in map_shards(pool, counter, sentences, shard_size,
+                                                         processes):
+
+            for (word, count) in shard_unigrams.items():
+                unigrams[word] += count
+
+            for entry in shard_ngrams.items():
+                yield entry
+
+    try:
+        ngrams = sum_counts(shard_counts(), spill_dir, max_ngrams)
+
+    except:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        raise
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+    def merged():
+
+        try:
+            for entry in ngrams:
+                yield entry
+
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    return (dict(unigrams), merged())
+
+# count_bigrams
+#
+# args:     sentences       an iterable over tokenized sentences (e.g. tokenize_stream)
+#           [processes]     (OPTIONAL) the number of worker processes
+#           [shard_size]    (OPTIONAL) the number of sentences counted by a worker at a time
+#           [max_bigrams]   (OPTIONAL) the number of distinct bigrams held in memory before
+#                           they are spilled to disk
+#           [spill_dir]     (OPTIONAL) the directory to create the spill files under
+#
+# returns:  (unigram counts, bigram counts), as returned by count_ngrams for order 2
+
+def count_bigrams(sentences, processes=None, shard_size=10000, max_bigrams=5000000,
+                  spill_dir=None):
+
+    return count_ngrams(sentences, 2, False, processes, shard_size, max_bigrams, spill_dir)
+
+# estimate_bigrams
+#
+# args:     corpus          a training corpus: the name of a text file (tokenized line by line,
+#                           as by tokenize) or an iterable over tokenized sentences
+#           [options]       (OPTIONAL) passed on to count_bigrams
+#
+# returns:  a FrozenBigramLM estimated from the corpus, without holding the corpus (or, past
+#           the budget, its bigram counts) in memory
+
+def estimate_bigrams(corpus, **options):
+
+    if isinstance(corpus, str):
+        corpus = tokenize_stream(corpus)
+
+    (unigrams, bigrams) = count_bigrams(corpus, **options)
+
+    model = FrozenBigramLM()
+    model.CompileCounts(unigrams, bigrams)
+
+    return model
+
+# estimate_kneser_ney
+#
+# args:     corpus          a training corpus: the name of a text file (tokenized line by line,
+#                           as by tokenize) or an iterable over tokenized sentences
+#           [order]         (OPTIONAL) the order of the model
+#           [processes]     (OPTIONAL) the number of worker processes
+#           [shard_size]    (OPTIONAL) the number of sentences counted by a worker at a time
+#           [max_ngrams]    (OPTIONAL) the number of distinct n-grams held in memory before
+#                           they are spilled to disk
+#           [spill_dir]     (OPTIONAL) the directory to create the count files under
+#
+# returns:  a KneserNeyLM estimated from the corpus, as by KneserNeyLM.EstimateNGrams, without
+#           holding the corpus or (past the budget) its n-gram counts in memory; its words are
+#           interned in a new Vocabulary in sorted order
+#
+# notes:    the counts of each order are written to a file of their own, sorted by n-gram; the
+#           adjusted counts of order k are its sentence-start counts plus one continuation
+#           count per distinct (k + 1)-gram, summed through spill files. Since ids follow the
+#           sort order of the words, each file is read back in trie order by
+#           KneserNeyLM.CompileLevel (twice: once for the discounts, once for the level)
+
+def estimate_kneser_ney(corpus, order=3, processes=None, shard_size=10000, max_ngrams=5000000,
+                        spill_dir=None):
+
+    if isinstance(corpus, str):
+        corpus = tokenize_stream(corpus)
+
+    work_dir = tempfile.mkdtemp(prefix="kneser_ney", dir=spill_dir)
+
+    try:
+        (unigrams, ngrams) = count_ngrams(corpus, order, True, processes, shard_size,
+                                          max_ngrams, work_dir)
+
+        vocab = Vocabulary()
+        for word in sorted(set(unigrams) | set(["<s>", "</s>"])):
+            vocab.add(word)
+
+        # split the counts by order: the highest order holds every n-gram, each lower order
+        # the k-grams that start a sentence
+        level_files = [os.path.join(work_dir, "order%d.counts" % k) for k in range(order + 1)]
+        level_outs  = [open(file_name, 'w') for file_name in level_files]
+
+        for (ngram, count) in ngrams:
+            level_outs[len(ngram)].write("%s\t%d\n" % (" ".join(ngram), count))
+
+        for out in level_outs:
+            out.close()
+
+        # add the continuation counts, highest lower order first
+        for k in range(order - 1, 0, -1):
+
+            continuations = sum_counts(((ngram[1:], 1) for (ngram, _)
+                                        in read_spill(level_files[k + 1])),
+                                       work_dir, max_ngrams)
+
+            level_files[k] = write_counts(merge_counts([read_spill(level_files[k]),
+                                                        continuations]), work_dir)
+
+        model = KneserNeyLM(order, vocab)
+
+        for k in range(1, order + 1):
+
+            model.discounts[k] = model.Discounts(count for (_, count)
+                                                 in read_spill(level_files[k]))
+
+            model.CompileLevel(k, ((vocab.encode(ngram), count)
+                                   for (ngram, count) in read_spill(level_files[k])))
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return model
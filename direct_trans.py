@@ -14,18 +14,58 @@ import sys
 from collections import defaultdict
 import csv
 import string
-from utilities import get_word_translations, tokenize, get_datasets
+from utilities import get_word_translations, tokenize, tokenize_stream, get_datasets
+from phrase_table import PhraseTable
 
 class DirectTrans:
 
 	# init
     #
     # args:     translation_table   dict, takes a first key (the word) and return a list of
-    #                               all possible translations for that first key
+    #                               all possible translations for that first key (or a
+    #                               PhraseTable)
     def __init__(self, translation_table):
 
         self.all_translations = translation_table
-        
+
+        # best_translations[word] = the most probable translation of the word, found once here
+        # rather than for every occurrence of the word
+        self.best_translations = self.best_index(translation_table)
+
+    # best_index
+    #
+    # args:     translation_table   the translation table (a dict table or a PhraseTable)
+    #
+    # returns:  dict, best_index[word] = the most probable translation of the word, for every
+    #           word (source phrase) of the table with a translation; ties go to the first
+    #           translation seen, as in a scan of the word's translations
+
+    def best_index(self, translation_table):
+
+        best = {}
+
+        if isinstance(translation_table, PhraseTable):
+
+            vocab = translation_table.vocab
+            for source in translation_table:
+                (trans, _) = translation_table[source].best()
+                best[" ".join(vocab.decode(source))] = " ".join(vocab.decode(trans))
+
+            return best
+
+        for word in translation_table:
+
+            best_trans = (None, None)
+
+            for (trans, prob) in translation_table[word].items():
+                if best_trans[1] is None or prob > best_trans[1]:
+                    best_trans = (trans, prob)
+
+            if best_trans[0] is not None:
+                best[word] = best_trans[0]
+
+        return best
+
     # translate
     #
     # args:     source_sent         the source (foreign) sentence
@@ -38,22 +78,26 @@ class DirectTrans:
 
     def translate(self, source_sent):
 
-    	trans_sent = []
+        best = self.best_translations
 
-    	for word in source_sent:
+        return [best[word] for word in source_sent if word in best]
 
-    		# (word, prob)
-    		best_trans = (None, None)
+    # translate_many
+    #
+    # args:     sentences           the source (foreign) sentences: the name of a text file
+    #                               (tokenized line by line, as by tokenize) or an iterable over
+    #                               tokenized sentences
+    #
+    # returns:  a generator over the direct translations of the sentences, in order, reading
+    #           the sentences one at a time
 
-    		for trans in self.all_translations[word]:
-    			prob = self.all_translations[word][trans]
-    			if best_trans[1] is None or prob > best_trans[1]:
-    				best_trans = (trans, prob)
+    def translate_many(self, sentences):
 
-    		if best_trans[0] is not None:
-    			trans_sent.append(best_trans[0])
+        if isinstance(sentences, str):
+            sentences = tokenize_stream(sentences)
 
-    	return trans_sent
+        for source_sent in sentences:
+            yield self.translate(source_sent)
 
 def main():
 
@@ -67,8 +111,8 @@ def main():
 
 	test_output = open('trans_direct.txt','w')
 
-	for i in range(len(test_set)):
-		test_output.write(' '.join(translator.translate(test_set[i])) + "\n")
+	for translation in translator.translate_many(test_set):
+		test_output.write(' '.join(translation) + "\n")
 
 	test_output.close()
 
@@ -0,0 +1,157 @@
+# Phrase Table Filtering (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                     PHRASE TABLE FILTERING                                     #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+Filters a text translation table (in the format read by get_word_translations) down to the
+entries a given set of source sentences can use, i.e. those whose source (foreign) phrase occurs
+in one of the sentences. The sentences are indexed once, as the set of all of their phrases up
+to the longest the table builder extracts (MAX_PHRASE_LENGTH), in the form the decoder translates
+them (see decoder_input: in lowercase, after a "NULL" word), and the table is then streamed
+through line by line, so neither the whole table nor its parsed entries are ever held in memory. The kept lines are written out
+unchanged, and the filtered table loads like the original (or converts to a binary table, see
+phrase_table.py).
+
+"""
+
+import csv
+import sys
+from utilities import tokenize_stream, decoder_input, get_word_translations
+from vocab import Vocabulary
+from phrase_table import PhraseTrie
+
+# the longest source phrase (in words) the table builder extracts: symmetrizer.py keeps phrases
+# spanning up to MAX_PHRASE_LEN (7) positions past their first word (it runs its main when
+# imported, so the value is repeated here)
+MAX_PHRASE_LENGTH = 8
+
+# substring_index
+#
+# args:     sentences       an iterable over tokenized source sentences
+#           [max_length]    (OPTIONAL) the longest phrase (in words) to index, by default the
+#                           longest the table builder extracts; None indexes every phrase of
+#                           every sentence, which grows quadratically with sentence length
+#
+# returns:  the set of the phrases the decoder can look up in the sentences (see
+#           decoder_input), each a tuple of words
+
+def substring_index(sentences, max_length=MAX_PHRASE_LENGTH):
+
+    phrases = set()
+
+    for sentence in sentences:
+
+        sentence = tuple(decoder_input(sentence))
+
+        for start in range(len(sentence)):
+
+            last = len(sentence) if max_length is None else min(len(sentence), start + max_length)
+
+            for end in range(start + 1, last + 1):
+                phrases.add(sentence[start:end])
+
+    return phrases
+
+# filter_translations
+#
+# args:     table_file      a text translation table (as read by get_word_translations)
+#           sentences       the source sentences: the name of a text file (tokenized line by
+#                           line, as by tokenize) or an iterable over tokenized sentences
+#           out_file        the file to write the filtered table to
+#           [max_length]    (OPTIONAL) the longest source phrase (in words) to keep (see
+#                           substring_index)
+#
+# returns:  (number of entries kept, number of entries read); writes every line of the table
+#           whose source phrase occurs in the sentences to out_file, in table order
+
+def filter_translations(table_file, sentences, out_file, max_length=MAX_PHRASE_LENGTH):
+
+    if isinstance(sentences, str):
+        sentences = tokenize_stream(sentences)
+
+    phrases = substring_index(sentences, max_length)
+
+    (kept, read) = (0, 0)
+
+    with open(table_file, 'r') as f, open(out_file, 'w') as out:
+        for line in f:
+
+            if not line.strip():
+                continue
+
+            # parsed as get_word_translations does: "foreign phrase" "english phrase" score
+            (foreign, _, _) = next(csv.reader([line], delimiter=' '))
+            read = read + 1
+
+            if tuple(foreign.split()) in phrases:
+                out.write(line)
+                kept = kept + 1
+
+    return (kept, read)
+
+# check_filter
+#
+# args:     table_file      a text translation table
+#           filtered_file   the table filtered for the sentences by filter_translations
+#           sentences       the source sentences, as for filter_translations
+#
+# returns:  the number of sentences for which the two tables give the decoder different
+#           translation options (0 if the filter kept everything the decoder can use)
+#
+# notes:    loads both tables into memory, so it is meant for checking the filter on a sample
+
+def check_filter(table_file, filtered_file, sentences):
+
+    if isinstance(sentences, str):
+        sentences = tokenize_stream(sentences)
+
+    vocab = Vocabulary()
+    full     = PhraseTrie(get_word_translations(table_file, vocab))
+    filtered = PhraseTrie(get_word_translations(filtered_file, vocab))
+
+    def options(trie, words):
+        return sorted((start, end, english, score)
+                      for start in range(len(words))
+                      for (end, translations) in trie.matches(words, start)
+                      for (english, score) in translations.items())
+
+    differ = 0
+    for sentence in sentences:
+
+        words = vocab.encode(decoder_input(sentence))
+
+        if options(full, words) != options(filtered, words):
+            differ = differ + 1
+
+    return differ
+
+def main():
+
+    args  = [arg for arg in sys.argv[1:] if arg != "--check"]
+    check = len(args) < len(sys.argv) - 1
+
+    if len(args) < 3:
+        print "usage: python filter_table.py [--check] <table file> <source text file> " \
+              "<output file> [max phrase length]"
+        sys.exit(1)
+
+    max_length = int(args[3]) if len(args) > 3 else MAX_PHRASE_LENGTH
+
+    (kept, read) = filter_translations(args[0], args[1], args[2], max_length)
+
+    print "kept %d of %d entries" % (kept, read)
+
+    if check:
+        print "sentences with different translation options:", \
+              check_filter(args[0], args[2], args[1])
+
+if __name__ == "__main__":
+    main()
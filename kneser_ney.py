@@ -0,0 +1,279 @@
+# Kneser-Ney Language Model (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                   KNESER-NEY LANGUAGE MODEL                                    #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+An n-gram language model (a trigram model by default) with interpolated, modified Kneser-Ney
+smoothing, as described in:
+
+    - "An Empirical Study of Smoothing Techniques for Language Modeling" by Stanley Chen and
+      Joshua Goodman (Harvard TR-10-98)
+
+The highest order is estimated from discounted counts; every lower order is estimated from
+continuation counts (the number of distinct words seen before an n-gram), except for n-grams that
+start a sentence, which can have no word before them and keep their raw counts. Each n-gram gets
+one of three discounts (for counts of 1, 2 and 3+), and each context interpolates with the next
+lower order using the mass its discounts freed up.
+
+Once estimated, the interpolated probabilities are stored in backoff form (see BackoffLM), in a 
+trie of sorted arrays instead of the dict entries the counts were collected in. The counts are
+collected in memory (see LoadNGrams), so EstimateNGrams suits corpora whose n-gram counts fit;
+for larger corpora, estimate_kneser_ney (see bigram_counts.py) counts through spill files and
+compiles the trie level by level from the sorted counts (see CompileLevel).
+
+"""
+
+import sys
+from array import array
+from itertools import groupby
+from collections import defaultdict
+from math import log, exp
+from backoff import BackoffLM, WORD_BITS, WORD_MASK
+
+# KneserNeyLM
+#
+# words are interned in the model's vocabulary when the training corpus is loaded, with "<s>" and
+# "</s>" marking the start and end of each sentence; while counting, each n-gram is packed into a
+# single integer (see WORD_BITS)
+
+class KneserNeyLM(BackoffLM):
+
+    # init
+    #
+    # args:     [order]     (OPTIONAL) the order of the model (3 for a trigram model)
+    #           [vocab]     (OPTIONAL) the Vocabulary to intern words in, e.g. to share ids with
+    #                       a translation table; a new one is created by default
+
+    def __init__(self, order=3, vocab=None):
+
+        if order < 2:
+            raise ValueError("The order of the model must be at least 2.")
+
+        BackoffLM.__init__(self, order, vocab)
+
+        # discounts[k] = (D1, D2, D3+) used for order k
+        self.discounts = [None] * (order + 1)
+
+    # EstimateNGrams
+    #
+    # args:     train_corpus    the training corpus to model (a list of tokenized sentences)
+    #
+    # returns:  none; counts the n-grams of the train_corpus and builds the model from them
+
+    def EstimateNGrams(self, train_corpus):
+
+        counts = self.LoadNGrams(train_corpus)
+        self.AdjustCounts(counts)
+        self.Compile(counts)
+
+    # LoadNGrams
+    #
+    # args:     train_corpus    the training corpus to model
+    #
+    # returns:  counts, where counts[k][ngram] is the number of times the (packed) k-gram was
+    #           seen; the highest order holds every n-gram, each lower order only the k-grams
+    #           that start a sentence (or a sentence shorter than the order)
+
+    def LoadNGrams(self, train_corpus):
+
+        order   = self.order
+        counts  = [defaultdict(int) for _ in range(order + 1)]
+        highest = counts[order]
+        mask    = (1 << (order * WORD_BITS)) - 1
+
+        for sentence in train_corpus:
+
+            ids = (self.start_token,) + self.vocab.encode(sentence, add=True) + \
+                  (self.end_token,)
+
+            ngram = 0
+            for (i, word) in enumerate(ids):
+
+                ngram = ((ngram << WORD_BITS) | word) & mask
+
+                if i >= order - 1:
+                    highest[ngram] = highest[ngram] + 1
+                elif i >= 1:
+                    counts[i + 1][ngram] = counts[i + 1][ngram] + 1
+
+        if len(self.vocab) > WORD_MASK:
+            raise ValueError("The vocabulary is too large to pack into n-grams.")
+
+        return counts
+
+    # AdjustCounts
+    #
+    # args:     counts      the n-gram counts returned by LoadNGrams
+    #
+    # returns:  none; adds the continuation counts of every lower order k-gram (the number of
+    #           distinct (k + 1)-grams it ends) to counts
+
+    def AdjustCounts(self, counts):
+
+        for k in range(self.order - 1, 0, -1):
+
+            lower = counts[k]
+            mask  = (1 << (k * WORD_BITS)) - 1
+
+            for ngram in counts[k + 1]:
+                suffix = ngram & mask
+                lower[suffix] = lower[suffix] + 1
+
+    # Discounts
+    #
+    # args:     counts      an iterable over the (adjusted) counts of one order
+    #
+    # returns:  the discounts (D1, D2, D3+) for n-grams seen once, twice and 3+ times, estimated
+    #           from the counts of counts (Chen & Goodman, eq. 26)
+    #
+    # notes:    on small corpora a count of counts can be 0, or the estimate can fall outside
+    #           (0, i]; such a discount falls back to the single (unmodified Kneser-Ney)
+    #           discount Y, so that every context keeps some mass for the lower order
+
+    def Discounts(self, counts):
+
+        n = [0] * 5
+        for count in counts:
+            if count <= 4:
+                n[count] = n[count] + 1
+
+        if n[1] > 0:
+            Y = float(n[1]) / (n[1] + 2 * n[2])
+        else:
+            Y = 0.5
+
+        discounts = []
+        for i in (1, 2, 3):
+
+            D = i - (i + 1) * Y * n[i + 1] / n[i] if n[i] > 0 else Y
+
+            if not 0 < D <= i:
+                D = Y
+
+            discounts.append(D)
+
+        return tuple(discounts)
+
+    # Compile
+    #
+    # args:     counts      the adjusted n-gram counts
+    #
+    # returns:  none; computes the discounts of every order and compiles the levels of the
+    #           trie from the counts, lowest order first (the counts of each order are released
+    #           once that order is stored)
+    #
+    # notes:    the counts are held in memory, as collected by LoadNGrams; for a corpus whose
+    #           counts do not fit, see estimate_kneser_ney in bigram_counts.py, which compiles
+    #           each level from a sorted stream of counts read back from disk
+
+    def Compile(self, counts):
+
+        for k in range(1, self.order + 1):
+
+            ngram_counts = counts[k]
+            self.discounts[k] = self.Discounts(ngram_counts.values())
+
+            self.CompileLevel(k, ((self.Unpack(ngram, k), ngram_counts[ngram])
+                                  for ngram in sorted(ngram_counts)))
+
+            counts[k] = None
+
+    # CompileLevel
+    #
+    # args:     k           the order of the level to compile; every lower order must already
+    #                       be compiled, and the discounts of this order set
+    #           entries     an iterable over the (k-gram, adjusted count) of every k-gram, where
+    #                       each k-gram is a tuple of word ids, sorted by k-gram
+    #
+    # returns:  none; computes the interpolated probability of every k-gram and the backoff
+    #           weight of every context, and stores them as level k of the trie (and the
+    #           backoff weights of level k - 1)
+    #
+    # notes:    entries are consumed in a single pass, and only the extensions of one context
+    #           are held at a time
+
+    def CompileLevel(self, k, entries):
+
+        if k == 1:
+            return self.CompileUnigrams(entries)
+
+        D = self.discounts[k]
+        num_parents = self.NumNGrams(k - 1)
+
+        words     = self.words[k]         = array('i')
+        log_probs = self.log_probs[k]     = array('f')
+        backoffs  = self.backoffs[k - 1]  = array('f', [0.0]) * num_parents
+        children  = self.children[k - 1]  = array('i', [0]) * (num_parents + 1)
+
+        lower_log_probs = self.log_probs[k - 1]
+
+        for (context, extensions) in groupby(entries, key=lambda entry: entry[0][:-1]):
+
+            extensions = list(extensions)
+            p = self.Find(context)
+
+            context_counts = [count for (_, count) in extensions]
+            total = float(sum(context_counts))
+            gamma = self.Gamma(D, context_counts) / total
+
+            backoffs[p] = log(gamma)
+
+            for (ngram, count) in extensions:
+
+                lower = exp(lower_log_probs[self.Find(ngram[1:])])
+
+                words.append(ngram[-1])
+                log_probs.append(log(max(count - D[min(count, 3) - 1], 0) / total +
+                                     gamma * lower))
+
+            children[p + 1] = len(words)
+
+        # contexts arrive in trie order, so a context with no extensions starts (and ends)
+        # where the last context before it ended
+        for p in range(1, num_parents + 1):
+            children[p] = max(children[p], children[p - 1])
+
+    # CompileUnigrams
+    #
+    # args:     entries     an iterable over the ((word,), adjusted count) of every unigram
+    #
+    # returns:  none; computes the probability of every word in the vocabulary, interpolated
+    #           with the uniform distribution, and stores them as level 1 of the trie
+
+    def CompileUnigrams(self, entries):
+
+        V = len(self.vocab)
+        D = self.discounts[1]
+
+        unigrams = [(ngram[0], count) for (ngram, count) in entries]
+
+        total = float(sum(count for (_, count) in unigrams))
+        gamma = self.Gamma(D, [count for (_, count) in unigrams]) / total
+
+        self.num_words = V
+        self.unknown_log_prob = log(gamma / V)
+
+        self.log_probs[1] = array('f', [self.unknown_log_prob]) * V
+        for (word, count) in unigrams:
+            self.log_probs[1][word] = log(max(count - D[min(count, 3) - 1], 0) / total +
+                                          gamma / V)
+
+    # Gamma
+    #
+    # args:     D           the discounts (D1, D2, D3+) of an order
+    #           counts      the counts of the extensions of a context
+    #
+    # returns:  the total count taken from the extensions by discounting, i.e. the mass (times
+    #           the context's total count) given to the lower order
+
+    def Gamma(self, D, counts):
+
+        return sum(D[min(count, 3) - 1] for count in counts)
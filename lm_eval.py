@@ -0,0 +1,294 @@
+# Language Model Evaluation (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                    LANGUAGE MODEL EVALUATION                                   #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+Vectorized (NumPy) evaluation of a bigram language model. Every function works on the arrays of
+a FrozenBigramLM (BigramLM.freeze(), or FrozenBigramLM.Load), viewed as NumPy arrays without
+copying, so a whole corpus or every bigram of the model is handled in a few array passes:
+
+    - deleted_interpolation: the simple linear interpolation weights of BigramLM.ApplyDeletedInterp
+    - check_normalization: how far each context's distribution is from summing to 1
+    - perplexity: the Laplace-smoothed perplexity of a held-out corpus
+    - parallel_perplexity: the same, for a held-out corpus split into shards that worker
+      processes score against a saved (memory-mapped) model
+
+"""
+
+import sys
+import numpy
+from multiprocessing import Pool, cpu_count
+from bigram import FrozenBigramLM
+from utilities import MappedArray, tokenize_stream, map_shards
+from quantize import QuantizedArray
+
+# as_numpy
+#
+# args:     values      an array (or MappedArray, or QuantizedArray) of a FrozenBigramLM
+#
+# returns:  a NumPy array sharing the memory of values (a quantized array is decoded into a
+#           new array)
+
+def as_numpy(values):
+
+    if isinstance(values, QuantizedArray):
+        return as_numpy(values.codebook.centers)[as_numpy(values.codes)]
+
+    if isinstance(values, MappedArray):
+        return numpy.frombuffer(values.buffer, dtype=values.typecode, count=values.length,
+                                offset=values.offset)
+
+    return numpy.frombuffer(values, dtype=values.typecode)
+
+# bigram_arrays
+#
+# args:     model       a FrozenBigramLM
+#
+# returns:  (first words, second words, counts) of every bigram of the model, as NumPy arrays
+
+def bigram_arrays(model):
+
+    offsets = as_numpy(model.offsets)
+
+    first  = numpy.repeat(numpy.arange(model.num_contexts), numpy.diff(offsets))
+    second = as_numpy(model.successors)
+    counts = as_numpy(model.counts).astype(numpy.float64)
+
+    return (first, second, counts)
+
+# deleted_interpolation
+#
+# args:     model       a FrozenBigramLM
+#
+# returns:  (unigram weight, bigram weight) for simple linear interpolation, as computed by
+#           BigramLM.ApplyDeletedInterp: each bigram's count goes to the weight of whichever
+#           estimate (bigram or unigram) predicts it better once that bigram is deleted from the
+#           counts (ties go to the bigram)
+
+def deleted_interpolation(model):
+
+    (first, second, counts) = bigram_arrays(model)
+    unigram_counts = as_numpy(model.unigram_counts).astype(numpy.float64)
+
+    # if the denominator of a case is zero, assume that the value of the case is zero
+    context_counts = unigram_counts[first] - 1
+    case_bigram = numpy.zeros(len(counts))
+    numpy.divide(counts - 1, context_counts, out=case_bigram, where=context_counts != 0)
+
+    if model.total_unigrams > 1:
+        case_unigram = (unigram_counts[second] - 1) / (model.total_unigrams - 1)
+    else:
+        case_unigram = numpy.zeros(len(counts))
+
+    bigram_wins = case_bigram >= case_unigram
+
+    w_bigram  = counts[bigram_wins].sum()
+    w_unigram = counts[~bigram_wins].sum()
+    w_total   = w_unigram + w_bigram
+
+    return (w_unigram / w_total, w_bigram / w_total)
+
+# check_normalization
+#
+# args:     model       a FrozenBigramLM
+#
+# returns:  a dict with, over every context that has successors: the largest deviation from 1 of
+#           the total unsmoothed probability ("unsmoothed_error"), and the smallest and largest
+#           total Laplace-smoothed probability over the words of the model ("laplace_min",
+#           "laplace_max")
+
+def check_normalization(model):
+
+    offsets   = as_numpy(model.offsets)
+    num_succ  = numpy.diff(offsets)
+    contexts  = numpy.nonzero(num_succ)[0]
+    starts    = offsets[contexts]
+
+    if not len(contexts):
+        return {"unsmoothed_error": 0.0, "laplace_min": 0.0, "laplace_max": 0.0}
+
+    unsmoothed = numpy.add.reduceat(numpy.exp(as_numpy(model.log_probs)), starts)
+
+    # every word of the model without a count after the context gets the unseen probability
+    seen   = numpy.add.reduceat(numpy.exp(as_numpy(model.laplace_log_probs)), starts)
+    unseen = (model.total_uq_unigrams - num_succ[contexts]) * \
+             numpy.exp(as_numpy(model.laplace_unseen)[contexts])
+    laplace = seen + unseen
+
+    return {"unsmoothed_error": float(numpy.abs(unsmoothed - 1).max()),
+            "laplace_min": float(laplace.min()),
+            "laplace_max": float(laplace.max())}
+
+# encode_bigrams
+#
+# args:     model       a FrozenBigramLM
+#           corpus      an iterable over tokenized sentences
+#
+# returns:  (first word ids, second word ids) of every bigram of the corpus, as NumPy arrays,
+#           where words outside the model have id -1
+
+def encode_bigrams(model, corpus):
+
+    first  = []
+    second = []
+
+    for sentence in corpus:
+
+        ids = [model.vocab.get(word, -1) for word in sentence]
+
+        first.extend(ids[:-1])
+        second.extend(ids[1:])
+
+    return (numpy.array(first, dtype=numpy.int64), numpy.array(second, dtype=numpy.int64))
+
+# log_probs
+#
+# args:     model       a FrozenBigramLM
+#           first       the first word ids of a batch of bigrams (-1 for unknown words)
+#           second      the second word ids of the bigrams (-1 for unknown words)
+#
+# returns:  the Laplace-smoothed log probability of every bigram (as FrozenBigramLM.
+#           LogProb_Laplace), found with one binary search over all of the model's bigrams
+
+def log_probs(model, first, second):
+
+    (model_first, model_second, _) = bigram_arrays(model)
+    num_contexts = model.num_contexts
+
+    # bigrams are numbered first * num_contexts + second; the CSR arrays are already in this
+    # order, so the model's keys are sorted
+    keys = model_first.astype(numpy.int64) * num_contexts + model_second
+
+    known   = (first >= 0) & (first < num_contexts)
+    seen    = known & (second >= 0) & (second < num_contexts)
+    queries = numpy.where(seen, first * num_contexts + second, 0)
+
+    i = numpy.searchsorted(keys, queries)
+    i_clipped = numpy.minimum(i, len(keys) - 1)
+    found = seen & (i < len(keys)) & (keys[i_clipped] == queries)
+
+    result = numpy.full(len(first), model.laplace_empty)
+    result[known] = as_numpy(model.laplace_unseen)[first[known]]
+
+    if len(keys):
+        result[found] = as_numpy(model.laplace_log_probs)[i_clipped[found]]
+
+    return result
+
+# corpus_log_prob
+#
+# args:     model       a FrozenBigramLM
+#           corpus      an iterable over tokenized sentences
+#
+# returns:  (total log probability, number of predicted words, number of unknown words) of the
+#           corpus, where every word but the first of each sentence is predicted
+
+def corpus_log_prob(model, corpus):
+
+    (first, second) = encode_bigrams(model, corpus)
+
+    return (float(log_probs(model, first, second).sum()), len(second),
+            int((second < 0).sum()))
+
+# perplexity
+#
+# args:     model       a FrozenBigramLM
+#           corpus      a held-out corpus (an iterable over tokenized sentences)
+#
+# returns:  a dict with the "log_prob", the number of "predictions", the number of unknown
+#           ("oov") words and the "perplexity" of the corpus under the Laplace-smoothed model
+
+def perplexity(model, corpus):
+
+    return summarize(*corpus_log_prob(model, corpus))
+
+# summarize
+#
+# args:     log_prob        the total log probability of a corpus
+#           predictions     the number of predicted words
+#           oov             the number of unknown words
+#
+# returns:  the dict returned by perplexity
+
+def summarize(log_prob, predictions, oov):
+
+    return {"log_prob": log_prob, "predictions": predictions, "oov": oov,
+            "perplexity": float(numpy.exp(-log_prob / predictions)) if predictions else None}
+
+# the model scored by the worker processes of parallel_perplexity; each worker maps the saved
+# model once, when it starts
+shard_model = None
+
+def load_model(model_file):
+
+    global shard_model
+    shard_model = FrozenBigramLM()
+    shard_model.Load(model_file)
+
+def score_shard(sentences):
+
+    return corpus_log_prob(shard_model, sentences)
+
+# parallel_perplexity
+#
+# args:     model_file      a FrozenBigramLM saved with FrozenBigramLM.Save
+#           corpus          a held-out corpus: the name of a text file (tokenized line by line)
+#                           or an iterable over tokenized sentences
+#           [processes]     (OPTIONAL) the number of worker processes (defaults to the number
+#                           of CPUs)
+#           [shard_size]    (OPTIONAL) the number of sentences scored by a worker at a time
+#
+# returns:  the dict returned by perplexity, for the whole corpus
+#
+# notes:    every worker memory-maps the same model file, so the model is only held in memory
+#           once; the shard totals are summed in the parent
+
+def parallel_perplexity(model_file, corpus, processes=None, shard_size=10000):
+
+    if isinstance(corpus, str):
+        corpus = tokenize_stream(corpus)
+
+    processes = processes or cpu_count()
+
+    pool = Pool(processes, initializer=load_model, initargs=(model_file,))
+
+    (log_prob, predictions, oov) = (0.0, 0, 0)
+
+    try:
+        for (shard_log_prob, shard_predictions, shard_oov) in \
+                map_shards(pool, score_shard, corpus, shard_size, processes):
+
+            log_prob    = log_prob + shard_log_prob
+            predictions = predictions + shard_predictions
+            oov         = oov + shard_oov
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return summarize(log_prob, predictions, oov)
+
+def main():
+
+    if len(sys.argv) < 3:
+        print "usage: python lm_eval.py <model file> <held-out text file> [processes]"
+        sys.exit(1)
+
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    lm = FrozenBigramLM()
+    lm.Load(sys.argv[1])
+
+    print "deleted interpolation weights (unigram, bigram):", deleted_interpolation(lm)
+    print "normalization:", check_normalization(lm)
+    print "held-out:", parallel_perplexity(sys.argv[1], sys.argv[2], processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+# Binary Phrase Table (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                      BINARY PHRASE TABLE                                       #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+A read-only translation table stored in a binary file, so that a decoder can open a large table
+by memory-mapping it instead of parsing the text table (see get_word_translations) into nested
+dicts on every start. The file holds:
+
+    - a string pool: every word of the table, newline-separated, in table word order
+    - the source (foreign) phrases, as runs of table word indices, sorted, so that a phrase is
+      found by binary search
+    - for every source phrase, the range of its options: the English phrases (again as runs of
+      word indices) and their scores, best score first
+
+Convert a text table once with convert_translations (or "python phrase_table.py <text table>
+<binary table>"); loading it only reads the header and the string pool, and the rest of the
+file is read on access.
+
+"""
+
+import os
+import sys
+import copy
+import mmap
+import struct
+from array import array
+from vocab import Vocabulary
+from utilities import get_word_translations, write_array, map_array, MappedArray
+from quantize import quantize, QuantizedArray
+
+# PhraseTable
+#
+# looked up like the dict tables of get_word_translations (in, [], get, iteration over source
+# phrases), with phrases as tuples of word ids of the table's vocabulary (or as strings or lists
+# of words). The words stored in the file are interned in that vocabulary when the table is
+# loaded, so a table can share the vocabulary of a language model. Unlike the defaultdicts of
+# get_word_translations, lookups never add anything to the table, and a table can be pickled
+# (a loaded table is pickled by file name, and mapped again when it is unpickled)
+
+class PhraseTable(object):
+
+    # the binary file format: a header (magic string, format version, sizes), the string pool,
+    # then the arrays in the order of ARRAYS, each padded to 8 bytes
+    MAGIC   = "PHRASETB"
+    VERSION = 1
+    HEADER  = struct.Struct("<8sIqqqqqq")
+
+    # (name, typecode) of the arrays:
+    # - source_offsets[i] .. source_offsets[i + 1]: the range of the i-th source phrase in
+    #   source_words
+    # - option_offsets[i] .. option_offsets[i + 1]: the range of the i-th source phrase's
+    #   options
+    # - target_offsets[j] .. target_offsets[j + 1]: the range of the j-th option's English
+    #   phrase in target_words
+    # - scores[j]: the score of the j-th option
+    ARRAYS  = [('source_offsets', 'i'), ('source_words', 'i'), ('option_offsets', 'i'),
+               ('target_offsets', 'i'), ('target_words', 'i'), ('scores', 'd')]
+
+    # init
+    #
+    # args:     [translations]  (OPTIONAL) a translation table keyed by tuples of word ids (as
+    #                           from get_word_translations with a vocab) to compile
+    #           [vocab]         (OPTIONAL) the Vocabulary the translations are interned in
+    #
+    # notes:    if no table is given, the table is empty until it is loaded (see Load)
+
+    def __init__(self, translations=None, vocab=None):
+
+        if translations is not None:
+            self.Compile(translations, vocab)
+
+    def __len__(self):
+        return len(self.option_offsets) - 1
+
+    def __contains__(self, source):
+        return self.find(source) >= 0
+
+    def __getitem__(self, source):
+
+        i = self.find(source)
+
+        if i < 0:
+            raise KeyError(source)
+
+        return self.option_list(i)
+
+    def __iter__(self):
+
+        for i in range(len(self)):
+            yield self.phrase(self.source_words, self.source_offsets, i)
+
+    def __getstate__(self):
+
+        state = dict(self.__dict__)
+
+        # a loaded table's arrays live in its file (except the ones replaced since, e.g. by
+        # Quantize)
+        if self.file_name is not None:
+            for (name, _) in self.ARRAYS:
+                if isinstance(state[name], MappedArray):
+                    del state[name]
+            del state['buffer']
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        if self.file_name is not None:
+            self.Map(self.file_name)
+            self.__dict__.update(state)
+
+    # a shallow copy shares the arrays (the default copy would map a loaded table's file again)
+    def __copy__(self):
+
+        table = PhraseTable.__new__(PhraseTable)
+        table.__dict__.update(self.__dict__)
+
+        return table
+
+    # Compile
+    #
+    # args:     translations    dict, translations[foreign][english] = score, with both phrases
+    #                           as tuples of word ids
+    #           vocab           the Vocabulary the phrases are interned in
+    #
+    # returns:  none; fills the arrays of this table from the given table
+
+    def Compile(self, translations, vocab):
+
+        self.vocab = vocab
+        self.file_name = None
+
+        # the table's word indices are the vocabulary's ids
+        self.word_ids = array('i', range(len(vocab)))
+        self.table_ids = self.word_ids
+
+        self.source_offsets = array('i', [0])
+        self.source_words = array('i')
+        self.option_offsets = array('i', [0])
+        self.target_offsets = array('i', [0])
+        self.target_words = array('i')
+        self.scores = array('d')
+
+        for foreign in sorted(translations):
+
+            self.source_words.extend(foreign)
+            self.source_offsets.append(len(self.source_words))
+
+            options = sorted(translations[foreign].items(), key=lambda option: -option[1])
+
+            for (english, score) in options:
+                self.target_words.extend(english)
+                self.target_offsets.append(len(self.target_words))
+                self.scores.append(score)
+
+            self.option_offsets.append(len(self.scores))
+
+    # Save
+    #
+    # args:     file_name   the file to save the table to
+    #
+    # returns:  none; writes the table in the binary format read by Load (under a temporary
+    #           name, then renamed, as FrozenBigramLM.Save does)
+
+    def Save(self, file_name):
+
+        words = "\n".join(self.vocab.decode(self.word_ids))
+
+        tmp_name = "%s.%d.tmp" % (file_name, os.getpid())
+        with open(tmp_name, 'wb') as f:
+
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(self.word_ids), len(words),
+                                     len(self), len(self.source_words), len(self.scores),
+                                     len(self.target_words)))
+
+            f.write(words)
+            f.write("\0" * (-len(words) % 8))
+
+            for (name, _) in self.ARRAYS:
+                write_array(f, getattr(self, name))
+
+        os.rename(tmp_name, file_name)
+
+    # Load
+    #
+    # args:     file_name   a file written by Save
+    #           [vocab]     (OPTIONAL) the Vocabulary to intern the table's words in, e.g. the
+    #                       vocabulary of a language model; a new one is created by default
+    #
+    # returns:  none; memory-maps the file, interning only the words of the string pool (the
+    #           arrays stay in the file, and are read on access)
+
+    def Load(self, file_name, vocab=None):
+
+        words = self.Map(file_name)
+        self.Index(words, vocab if vocab is not None else Vocabulary())
+
+    # Map
+    #
+    # args:     file_name   a file written by Save
+    #
+    # returns:  the words of the file's string pool; memory-maps the file and replaces this
+    #           table's arrays with the saved ones
+
+    def Map(self, file_name):
+
+        with open(file_name, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, num_words, words_len, num_sources, num_source_words, num_options,
+         num_target_words) = self.HEADER.unpack_from(buf, 0)
+
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("%s is not a phrase table file." % file_name)
+
+        offset = self.HEADER.size
+
+        words = buf[offset:offset + words_len].split("\n") if num_words else []
+
+        offset = offset + words_len + (-words_len % 8)
+
+        lengths = {'source_offsets': num_sources + 1, 'source_words': num_source_words,
+                   'option_offsets': num_sources + 1, 'target_offsets': num_options + 1,
+                   'target_words': num_target_words, 'scores': num_options}
+
+        for (name, typecode) in self.ARRAYS:
+            (values, offset) = map_array(buf, offset, typecode, lengths[name])
+            setattr(self, name, values)
+
+        self.buffer = buf
+        self.file_name = file_name
+
+        return words
+
+    # Quantize
+    #
+    # args:     [bits]      (OPTIONAL) the number of bits per score (1 to 16)
+    #
+    # returns:  the largest absolute error the quantization introduced into a score; replaces
+    #           the scores with a QuantizedArray, cutting them from 8 bytes per option to 1 (or
+    #           2); since quantizing keeps the order of the scores, every option list stays
+    #           sorted
+    #
+    # notes:    a quantized table is saved with its representative values, as doubles
+
+    def Quantize(self, bits=8):
+
+        if isinstance(self.scores, QuantizedArray):
+            raise ValueError("The table is already quantized.")
+
+        scores = quantize(self.scores, bits)
+        error  = scores.codebook.max_error(self.scores)
+
+        self.scores = scores
+
+        return error
+
+    # Index
+    #
+    # args:     words       the words of the table, in table word order
+    #           vocab       the Vocabulary to intern them in
+    #
+    # returns:  none; maps the table's word indices to and from the vocabulary's ids
+
+    def Index(self, words, vocab):
+
+        self.vocab = vocab
+
+        # word_ids[table word index] = vocabulary id, table_ids[vocabulary id] = table word
+        # index (or -1)
+        self.word_ids = array('i', (vocab.add(word) for word in words))
+        self.table_ids = array('i', [-1]) * len(vocab)
+        for (index, word_id) in enumerate(self.word_ids):
+            self.table_ids[word_id] = index
+
+    # Intern
+    #
+    # args:     vocab       a Vocabulary, e.g. that of a language model
+    #
+    # returns:  a copy of this table (sharing its arrays) whose phrases are tuples of ids of
+    #           the given vocabulary, as intern_translations does for dict tables
+
+    def Intern(self, vocab):
+
+        table = copy.copy(self)
+        table.Index(self.vocab.decode(self.word_ids), vocab)
+
+        return table
+
+    # EnglishWords
+    #
+    # returns:  the distinct words of the table's English phrases, in table word order (see
+    #           english_words for dict tables)
+
+    def EnglishWords(self):
+
+        return self.vocab.decode([self.word_ids[index] for index in sorted(set(self.target_words))])
+
+    # find
+    #
+    # args:     source      a source phrase, as a tuple of word ids, a string or a list of words
+    #
+    # returns:  the position of the phrase in the source index, or -1 if it has no options
+    #
+    # notes:    a binary search over the sorted source phrases, comparing them as tuples of
+    #           table word indices
+
+    def find(self, source):
+
+        if isinstance(source, str) or source and isinstance(source[0], str):
+            source = self.vocab.encode(source)
+
+        table_ids = self.table_ids
+
+        key = []
+        for word_id in source:
+
+            if word_id is None or not 0 <= word_id < len(table_ids) or table_ids[word_id] < 0:
+                return -1
+
+            key.append(table_ids[word_id])
+
+        key = tuple(key)
+
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+
+            mid = (lo + hi) // 2
+
+            if self.phrase(self.source_words, self.source_offsets, mid, False) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self) and self.phrase(self.source_words, self.source_offsets, lo,
+                                          False) == key:
+            return lo
+        else:
+            return -1
+
+    # phrase
+    #
+    # args:     words       source_words or target_words
+    #           offsets     the offsets of the phrases in words
+    #           i           the position of a phrase
+    #           [decode]    (OPTIONAL) whether to return vocabulary ids rather than table word
+    #                       indices
+    #
+    # returns:  the i-th phrase, as a tuple of word ids
+
+    def phrase(self, words, offsets, i, decode=True):
+
+        indices = [words[j] for j in range(offsets[i], offsets[i + 1])]
+
+        if decode:
+            return tuple(self.word_ids[index] for index in indices)
+
+        return tuple(indices)
+
+    # option_list
+    #
+    # args:     i           the position of a source phrase in the source index (see find)
+    #
+    # returns:  the OptionList of the source phrase
+
+    def option_list(self, i):
+
+        return OptionList(self, self.option_offsets[i], self.option_offsets[i + 1])
+
+    # options
+    #
+    # args:     source      a source phrase (a span of a sentence), as for find
+    #
+    # returns:  the OptionList holding every option of the phrase, best score first (empty if
+    #           the phrase is not in the table)
+
+    def options(self, source):
+
+        i = self.find(source)
+        return self.option_list(i) if i >= 0 else OptionList(self, 0, 0)
+
+    # get
+    #
+    # args:     source      a source phrase, as for find
+    #           [default]   the value to return for a phrase with no options
+    #
+    # returns:  the OptionList of the phrase (see options), or default
+
+    def get(self, source, default=None):
+
+        i = self.find(source)
+        return self.option_list(i) if i >= 0 else default
+
+    # matches
+    #
+    # args:     words       a sentence, as a tuple of word ids (None for unknown words)
+    #           start       a position in the sentence
+    #
+    # returns:  a generator over (end, options) for every phrase words[start:end] in the table,
+    #           in order of increasing end, where options is the phrase's OptionList
+    #
+    # notes:    the sorted source index doubles as a prefix trie: the phrases that extend a
+    #           prefix are a contiguous range of it, so each word of the sentence narrows the
+    #           range with two binary searches, and the walk stops as soon as it is empty
+
+    def matches(self, words, start):
+
+        table_ids = self.table_ids
+        offsets   = self.source_offsets
+        source    = self.source_words
+
+        # the word at position depth of the i-th phrase (-1 for a phrase that ends before it);
+        # within the range of phrases sharing a prefix of length depth, this is sorted
+        def word_at(i, depth):
+            j = offsets[i] + depth
+            return source[j] if j < offsets[i + 1] else -1
+
+        (lo, hi) = (0, len(self))
+
+        for end in range(start + 1, len(words) + 1):
+
+            word_id = words[end - 1]
+            if word_id is None or not 0 <= word_id < len(table_ids) or table_ids[word_id] < 0:
+                return
+
+            word  = table_ids[word_id]
+            depth = end - start - 1
+
+            (first, last) = (lo, hi)
+            while first < last:
+                mid = (first + last) // 2
+                if word_at(mid, depth) < word:
+                    first = mid + 1
+                else:
+                    last = mid
+
+            (lo, last) = (first, hi)
+            while first < last:
+                mid = (first + last) // 2
+                if word_at(mid, depth) <= word:
+                    first = mid + 1
+                else:
+                    last = mid
+
+            hi = first
+
+            if lo == hi:
+                return
+
+            # the prefix itself, if it is a phrase of the table, sorts first in its range
+            if offsets[lo + 1] - offsets[lo] == depth + 1:
+                yield (end, self.option_list(lo))
+
+# OptionList
+#
+# the options of one source phrase of a PhraseTable: a read-only view of a range of the table's
+# option arrays, best score first. It is read like the option dicts of get_word_translations
+# (iteration over English phrases, [], get, in, items), and its first entry is the best option
+
+class OptionList(object):
+
+    __slots__ = ('table', 'start', 'end')
+
+    def __init__(self, table, start, end):
+
+        self.table = table
+        self.start = start
+        self.end   = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+
+        for j in range(self.start, self.end):
+            yield self.english(j)
+
+    def __contains__(self, english):
+        return self.get(english) is not None
+
+    def __getitem__(self, english):
+
+        score = self.get(english)
+
+        if score is None:
+            raise KeyError(english)
+
+        return score
+
+    def english(self, j):
+        return self.table.phrase(self.table.target_words, self.table.target_offsets, j)
+
+    def keys(self):
+        return list(self)
+
+    # items
+    #
+    # returns:  the list of (English phrase, score) pairs of the options, best score first
+
+    def items(self):
+
+        scores = self.table.scores
+        return [(self.english(j), scores[j]) for j in range(self.start, self.end)]
+
+    # get
+    #
+    # args:     english     an English phrase, as a tuple of word ids
+    #           [default]   the value to return if the phrase is not an option
+    #
+    # returns:  the score of the option, or default (a linear scan: a phrase has few options)
+
+    def get(self, english, default=None):
+
+        english = tuple(english)
+        for j in range(self.start, self.end):
+            if self.english(j) == english:
+                return self.table.scores[j]
+
+        return default
+
+    # best
+    #
+    # returns:  (English phrase, score) of the best option, or None if there are none
+
+    def best(self):
+
+        if self.start == self.end:
+            return None
+
+        return (self.english(self.start), self.table.scores[self.start])
+
+# PhraseTrie
+#
+# a token-level prefix trie over the source phrases of a dict translation table (as from
+# get_word_translations with a vocab), for finding every phrase of a sentence in one walk per
+# start position (see PhraseTable.matches for binary tables). Nodes are numbered, and the trie
+# is held in one dict of edges rather than a dict per node
+
+class PhraseTrie(object):
+
+    # init
+    #
+    # args:     translations    dict, translations[foreign][english] = score, with both phrases
+    #                           as tuples of word ids
+
+    def __init__(self, translations):
+
+        # edges[(node, word)] = the child of node for the word (the root is node 0)
+        # phrases[node] = the options of the phrase that ends at node, or None
+        self.edges   = {}
+        self.phrases = [None]
+
+        for foreign in translations:
+
+            node = 0
+            for word in foreign:
+
+                child = self.edges.get((node, word))
+
+                if child is None:
+                    child = self.edges[(node, word)] = len(self.phrases)
+                    self.phrases.append(None)
+
+                node = child
+
+            self.phrases[node] = translations[foreign]
+
+    # matches
+    #
+    # args:     words       a sentence, as a tuple of word ids (None for unknown words)
+    #           start       a position in the sentence
+    #
+    # returns:  a generator over (end, options) for every phrase words[start:end] in the table,
+    #           in order of increasing end, where options is the table's dict of options; the
+    #           walk stops as soon as words[start:end] is no prefix of a phrase
+
+    def matches(self, words, start):
+
+        node = 0
+
+        for end in range(start + 1, len(words) + 1):
+
+            node = self.edges.get((node, words[end - 1]))
+
+            if node is None:
+                return
+
+            if self.phrases[node] is not None:
+                yield (end, self.phrases[node])
+
+# load_translations
+#
+# args:     text_file       a text translation table (as read by get_word_translations)
+#           [vocab]         (OPTIONAL) the Vocabulary to intern the table's words in
+#           [bits]          (OPTIONAL) if given, the scores are quantized to this many bits
+#                           (see PhraseTable.Quantize)
+#
+# returns:  the table as an in-memory PhraseTable, which (unlike the dict table it is built
+#           from) is compact, picklable and never grows on lookup
+
+def load_translations(text_file, vocab=None, bits=None):
+
+    vocab = vocab if vocab is not None else Vocabulary()
+    table = PhraseTable(get_word_translations(text_file, vocab), vocab)
+
+    if bits:
+        table.Quantize(bits)
+
+    return table
+
+# convert_translations
+#
+# args:     text_file       a text translation table (as read by get_word_translations)
+#           table_file      the binary table to write
+#
+# returns:  none; converts the text table to the binary format of PhraseTable
+
+def convert_translations(text_file, table_file):
+
+    load_translations(text_file).Save(table_file)
+
+# load_phrase_table
+#
+# args:     table_file      a binary table written by convert_translations (or PhraseTable.Save)
+#           [vocab]         (OPTIONAL) the Vocabulary to intern the table's words in
+#
+# returns:  the memory-mapped PhraseTable
+
+def load_phrase_table(table_file, vocab=None):
+
+    table = PhraseTable()
+    table.Load(table_file, vocab)
+
+    return table
+
+def main():
+
+    if len(sys.argv) != 3:
+        print "usage: python phrase_table.py <text table> <binary table>"
+        sys.exit(1)
+
+    convert_translations(sys.argv[1], sys.argv[2])
+
+if __name__ == "__main__":
+    main()
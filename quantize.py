@@ -0,0 +1,160 @@
+# Score Quantization (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                       SCORE QUANTIZATION                                       #
+#                                                                                                #
+##################################################################################################
+
+"""
+
+Lossy, compact storage for the log probabilities of the language models and the translation
+table. A Codebook maps every score onto one of 2^bits representative values (at most 16 bits),
+so a score can be stored as a 1- or 2-byte code in a packed array instead of an 8-byte double
+(or a boxed Python float):
+
+    - the codebook is built by equal-population binning, as in IRSTLM and KenLM: the sorted
+      scores are cut into 2^bits bins holding the same number of scores, and each bin is
+      represented by its mean; a set of scores with no more distinct values than bins is
+      stored exactly
+    - a score is encoded as the code of the nearest representative value
+
+Quantized models and tables keep their lookups unchanged: a QuantizedArray is read like the
+array it replaces (see FrozenBigramLM.Quantize, BackoffLM.Quantize and PhraseTable.Quantize).
+Each of those returns the largest error it introduced into a score (see Codebook.max_error).
+
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+
+# Codebook
+#
+# the representative values of a set of scores; centers[code] is the value of a code, and
+# bounds[code] the midpoint between centers[code] and centers[code + 1], so that a score is
+# encoded by a binary search over the bounds
+
+class Codebook(object):
+
+    # init
+    #
+    # args:     values      the (finite) scores to build the codebook for
+    #           [bits]      (OPTIONAL) the number of bits per code (1 to 16)
+
+    def __init__(self, values, bits=8):
+
+        if not 1 <= bits <= 16:
+            raise ValueError("Scores can only be quantized to 1 to 16 bits.")
+
+        values = sorted(values)
+
+        if values and not float("-inf") < values[0] <= values[-1] < float("inf"):
+            raise ValueError("Only finite scores can be quantized.")
+
+        self.bits = bits
+        self.typecode = 'B' if bits <= 8 else 'H'
+
+        num_bins = 1 << bits
+        distinct = sorted(set(values))
+
+        if len(distinct) <= num_bins:
+            centers = distinct
+        else:
+            centers = []
+            for b in range(num_bins):
+                bin_values = values[len(values) * b // num_bins:len(values) * (b + 1) // num_bins]
+                centers.append(sum(bin_values) / len(bin_values))
+
+        self.centers = array('d', centers)
+        self.bounds  = array('d', ((centers[c] + centers[c + 1]) / 2
+                                   for c in range(len(centers) - 1)))
+
+        # the representative values as float objects, shared by every lookup
+        self.floats = list(self.centers)
+
+    def __len__(self):
+        return len(self.centers)
+
+    # encode
+    #
+    # args:     value       a score
+    #
+    # returns:  the code of the representative value nearest to the score
+
+    def encode(self, value):
+
+        return bisect_left(self.bounds, value)
+
+    # decode
+    #
+    # args:     code        a code of this codebook
+    #
+    # returns:  the representative value of the code
+
+    def decode(self, code):
+
+        return self.floats[code]
+
+    # max_error
+    #
+    # args:     values      scores encoded with this codebook
+    #
+    # returns:  the largest absolute difference between a score and its representative value
+
+    def max_error(self, values):
+
+        return max([abs(value - self.floats[self.encode(value)]) for value in values] or [0.0])
+
+# QuantizedArray
+#
+# a read-only array of scores stored as codes of a Codebook, in a packed array of 1- or 2-byte
+# codes; it supports len(), indexing and iteration like the array of doubles it replaces
+
+class QuantizedArray(object):
+
+    __slots__ = ('codebook', 'codes', 'floats')
+
+    def __init__(self, codebook, codes):
+
+        self.codebook = codebook
+        self.codes    = codes
+        self.floats   = codebook.floats
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.floats[self.codes[i]]
+
+    def __getstate__(self):
+        return (self.codebook, self.codes)
+
+    def __setstate__(self, state):
+        (self.codebook, self.codes) = state
+        self.floats = self.codebook.floats
+
+    # tostring
+    #
+    # returns:  the decoded scores as raw doubles, so a quantized model is saved in the same
+    #           format as an unquantized one (see write_array)
+
+    def tostring(self):
+        return array('d', (self.floats[code] for code in self.codes)).tostring()
+
+# quantize
+#
+# args:     values      an array (or any sequence) of finite scores
+#           [bits]      (OPTIONAL) the number of bits per code (1 to 16)
+#
+# returns:  a QuantizedArray holding the scores, with a codebook built from them
+
+def quantize(values, bits=8):
+
+    codebook = Codebook(values, bits)
+    codes = array(codebook.typecode, (codebook.encode(value) for value in values))
+
+    return QuantizedArray(codebook, codes)
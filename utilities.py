@@ -13,26 +13,67 @@
 import csv
 import sys
 import string
+import struct
+import hashlib
+from itertools import islice
 from collections import defaultdict
 
 # get_word_translations
 #
 # args:		file_name		the file (formatted as a .csv) from which to obtain the word 
 #							translations
+#			[vocab]			(OPTIONAL) a Vocabulary; if given, both phrases of every entry are
+#							interned in it and the table is keyed by tuples of word ids
 #
 # returns:	the translation table generated from the data in the provided file
 
-def get_word_translations(file_name):
+def get_word_translations(file_name, vocab=None):
     reader = None
     translations = defaultdict(lambda : defaultdict(lambda : float("-inf")))
     with open(file_name, 'r') as f:
         reader = csv.reader(f, delimiter=' ')
         for row in reader:
             trg, src, prob = row
+            if vocab is not None:
+                trg, src = vocab.encode(trg, add=True), vocab.encode(src, add=True)
             translations[trg][src] = float(prob)
 
     return translations
 
+# intern_translations
+#
+# args:		translations	a translation table keyed by phrases (as from get_word_translations)
+#			vocab			the Vocabulary to intern the phrases in
+#
+# returns:	the same table keyed by tuples of word ids
+
+def intern_translations(translations, vocab):
+    interned = defaultdict(lambda : defaultdict(lambda : float("-inf")))
+    for trg in translations:
+        trg_ids = vocab.encode(trg, add=True)
+        for src in translations[trg]:
+            interned[trg_ids][vocab.encode(src, add=True)] = translations[trg][src]
+
+    return interned
+
+# english_words
+#
+# args:		translations	a translation table keyed by phrases (as from get_word_translations)
+#
+# returns:	the distinct words of the table's English phrases, in the order they are first seen
+
+def english_words(translations):
+    words = []
+    seen = set()
+    for trg in translations:
+        for src in translations[trg]:
+            for word in src.split():
+                if word not in seen:
+                    seen.add(word)
+                    words.append(word)
+
+    return words
+
 # tokenize
 #
 # args: 	filename 		a text file to tokenize
@@ -41,7 +82,16 @@ def get_word_translations(file_name):
 
 def tokenize(filename):
 
-    tokens = []
+    return list(tokenize_stream(filename))
+
+# tokenize_stream
+#
+# args: 	filename 		a text file to tokenize
+#
+# returns: 	a generator over the sentences of the given file, each a list of its words, reading
+#			the file one line at a time
+
+def tokenize_stream(filename):
 
     file_name = filename
     with open(file_name, 'r') as f:
@@ -52,9 +102,18 @@ def tokenize(filename):
 
             # ensure there are no empty lines in the input data file
             if tok_line:
-            	tokens.append(tok_line)
+            	yield tok_line
 
-    return tokens
+# decoder_input
+#
+# args:		source_sent		a tokenized source (foreign) sentence
+#
+# returns:	the words the decoder translates: the sentence in lowercase, with "NULL" (the source
+#			of English words that have no foreign counterpart) added to the beginning
+
+def decoder_input(source_sent):
+
+    return ["NULL"] + [word.lower() for word in source_sent]
 
 # get_datasets
 # 
@@ -70,4 +129,128 @@ def get_datasets(english, spanish):
     test_set = spanish[:100]
     translated_set = english[:100]
 
-    return training_set, test_set, translated_set
\ No newline at end of file
+    return training_set, test_set, translated_set
+
+# write_nbest
+#
+# args:		out_file		an open file to write the n-best list to
+#			sent_id			the index of the source sentence
+#			nbest			(translated sentence, features, score) triples, as returned by
+#							BeamSearch.translate_nbest
+#
+# returns:	none; writes one "sent_id ||| translation ||| features ||| score" line per entry,
+#			with the features as "name= value" pairs (the n-best format used by Moses), so
+#			n-best lists can be streamed out sentence by sentence
+
+def write_nbest(out_file, sent_id, nbest):
+
+    for (sentence, features, score) in nbest:
+        out_file.write("%d ||| %s ||| %s ||| %f\n" %
+                       (sent_id, " ".join(sentence),
+                        " ".join("%s= %f" % (name, value) for (name, value) in features), score))
+
+# map_shards
+#
+# args:		pool			a multiprocessing Pool
+#			function		the function to apply to each shard (a list of items)
+#			items			an iterable over the items to process (e.g. tokenize_stream)
+#			shard_size		the number of items in a shard
+#			processes		the number of worker processes in the pool
+#
+# returns:	a generator over the results of function on every shard, in the order they finish;
+#			shards are handed out a bounded number at a time, so the items are only read as fast
+#			as the workers process them
+
+def map_shards(pool, function, items, shard_size, processes):
+
+    items = iter(items)
+    shards = iter(lambda: list(islice(items, shard_size)), [])
+
+    while True:
+
+        round_shards = list(islice(shards, 2 * processes))
+        if not round_shards:
+            break
+
+        for result in pool.imap_unordered(function, round_shards):
+            yield result
+
+# corpus_fingerprint
+#
+# args:		corpus			a tokenized corpus (a list of sentences, each a list of words)
+#
+# returns:	a hex digest identifying the contents of the corpus, e.g. to key a cache of models
+#			trained on it
+
+def corpus_fingerprint(corpus):
+
+    digest = hashlib.sha1()
+    for sentence in corpus:
+        digest.update(" ".join(sentence) + "\n")
+
+    return digest.hexdigest()
+
+# MappedArray
+#
+# a read-only array of fixed-size values (typecode as in the array module, native byte order)
+# stored at an offset in a buffer such as an mmap. Values are unpacked on access, so mapping a
+# file costs nothing up front and every process that maps it shares the same pages; it supports
+# len(), indexing and iteration, which is all bisect and the models need
+
+class MappedArray(object):
+
+    __slots__ = ('typecode', 'itemsize', 'buffer', 'offset', 'length', 'unpack')
+
+    def __init__(self, buf, offset, typecode, length):
+
+        value = struct.Struct("=" + typecode)
+
+        self.typecode = typecode
+        self.itemsize = value.size
+        self.buffer   = buf
+        self.offset   = offset
+        self.length   = length
+        self.unpack   = value.unpack_from
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+
+        if not 0 <= i < self.length:
+            raise IndexError("MappedArray index out of range")
+
+        return self.unpack(self.buffer, self.offset + i * self.itemsize)[0]
+
+    def tostring(self):
+        return self.buffer[self.offset:self.offset + self.length * self.itemsize]
+
+# write_array
+#
+# args:		out_file		a binary file open for writing
+#			values			an array (or MappedArray) to write
+#
+# returns:	none; writes the raw values, padded to a multiple of 8 bytes so that the next
+#			array written starts aligned
+
+def write_array(out_file, values):
+
+    data = values.tostring()
+    out_file.write(data)
+    out_file.write("\0" * (-len(data) % 8))
+
+# map_array
+#
+# args:		buf				a buffer (e.g. an mmap) holding arrays written by write_array
+#			offset			the offset of the array in buf
+#			typecode		the typecode of the array
+#			length			the number of values in the array
+#
+# returns:	(a MappedArray over the values, the offset just past the array and its padding)
+
+def map_array(buf, offset, typecode, length):
+
+    values = MappedArray(buf, offset, typecode, length)
+    size   = length * values.itemsize
+
+    return (values, offset + size + (-size % 8))
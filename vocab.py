@@ -0,0 +1,96 @@
+# Vocabulary (for Machine Translation)
+
+# COMP 150: Natural Language Processing
+# Jason Krone & Nicholas Yan
+
+##################################################################################################
+#                                                                                                #
+#                                           VOCABULARY                                           #
+#                                                                                                #
+##################################################################################################
+
+# Vocabulary
+#
+# maps tokens to dense integer ids (0, 1, 2, ...) and back. Tokens are interned once, when the
+# data is loaded; after that the language model, the translation table and the decoder only
+# handle ids, and phrases are tuples of ids, so no string is hashed or split while decoding
+
+class Vocabulary(object):
+
+    def __init__(self):
+
+        # _ids[word] = id, _words[id] = word
+        self._ids   = {}
+        self._words = []
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    # add
+    #
+    # args:     word        a token
+    #
+    # returns:  the id of the token, giving it the next free id if it has not been seen before
+
+    def add(self, word):
+
+        word_id = self._ids.get(word)
+
+        if word_id is None:
+            word_id = self._ids[word] = len(self._words)
+            self._words.append(word)
+
+        return word_id
+
+    # get
+    #
+    # args:     word        a token
+    #           default     the value to return for an unknown token
+    #
+    # returns:  the id of the token, or default if it has not been seen before (the vocabulary
+    #           never grows on lookup)
+
+    def get(self, word, default=None):
+
+        return self._ids.get(word, default)
+
+    # word
+    #
+    # args:     word_id     the id of a token
+    #
+    # returns:  the token with the given id
+
+    def word(self, word_id):
+
+        return self._words[word_id]
+
+    # encode
+    #
+    # args:     words       a list of tokens (or a space-separated phrase)
+    #           add         whether to give unseen tokens new ids; if False, unseen tokens are
+    #                       encoded as None
+    #
+    # returns:  the tuple of ids for the tokens
+
+    def encode(self, words, add=False):
+
+        if isinstance(words, str):
+            words = words.split()
+
+        if add:
+            return tuple(self.add(word) for word in words)
+        else:
+            return tuple(self._ids.get(word) for word in words)
+
+    # decode
+    #
+    # args:     ids         a sequence of token ids
+    #
+    # returns:  the list of tokens for the ids
+
+    def decode(self, ids):
+
+        return [self._words[word_id] for word_id in ids]